@@ -0,0 +1,62 @@
+import os
+import time
+import threading
+
+import metrics
+
+# Admission control for heavy admin routes.
+# Flask gives every request its own thread, so license checks and admin bulk
+# work compete for the same CPU, GIL and SQLite lock. Admin work is funnelled
+# through a small gate: a few run at once, a bounded number wait, the rest
+# are shed with 503. Everything outside the gate (/verify, OAuth) keeps the
+# remaining capacity to itself.
+
+class AdmissionGate:
+    def __init__(self, name, concurrency, max_queue, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        metrics.register_gauge(f"{name}_active", lambda: self.active)
+        metrics.register_gauge(f"{name}_queue_depth", lambda: self.waiting)
+
+    def enter(self):
+        """Returns True once a slot is held, False if the request should be shed."""
+        start = time.monotonic()
+        with self._cond:
+            if self.active < self.concurrency and self.waiting == 0:
+                self.active += 1
+                metrics.observe(f"{self.name}_queue_wait", 0.0)
+                return True
+            if self.waiting >= self.max_queue:
+                metrics.inc(f"{self.name}_shed")
+                return False
+            self.waiting += 1
+            try:
+                deadline = start + self.max_wait
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.inc(f"{self.name}_shed")
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+        metrics.observe(f"{self.name}_queue_wait", time.monotonic() - start)
+        return True
+
+    def leave(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+admin_gate = AdmissionGate(
+    "admin",
+    concurrency=int(os.environ.get("ADMIN_CONCURRENCY", 2)),
+    max_queue=int(os.environ.get("ADMIN_QUEUE_MAX", 8)),
+    max_wait=float(os.environ.get("ADMIN_QUEUE_WAIT", 10)),
+)
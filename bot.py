@@ -12,7 +12,14 @@ import os
 import sqlite3
 import uuid
 import secrets
+import threading
 from user_utils import resolve_users_map
+import shmcache
+import eventbus
+import leases
+import columnar
+import keyfilter
+import fulltext
 
 # CONFIGURATION
 # Token must be provided via environment variable DISCORD_TOKEN (no token in code)
@@ -47,6 +54,14 @@ def save_config(config):
         json.dump(config, f, indent=4)
 
 # --- OFFLINE DB FALLBACK HELPERS ---
+# Admin reads the server tags with ETags; the last response per payload is kept
+# and re-sent with If-None-Match, so an unchanged view costs a 304
+CONDITIONAL_ENDPOINTS = {"/stats", "/list", "/blacklist/manage"}
+ETAG_CACHE_MAX = 32
+_etag_cache = {}
+# Fetches run on executor threads
+_etag_lock = threading.Lock()
+
 def _db_query_fallback_sync(endpoint, payload):
     """
     Attempts to call the API endpoint. 
@@ -54,9 +69,28 @@ def _db_query_fallback_sync(endpoint, payload):
     Returns a tuple: (status_code, json_response)
     """
     url = f"{API_URL}{endpoint}"
+    cache_key = (endpoint, json.dumps(payload, sort_keys=True))
+    headers = {}
+    cached = None
+    if endpoint in CONDITIONAL_ENDPOINTS:
+        with _etag_lock:
+            cached = _etag_cache.get(cache_key)
+    if cached:
+        headers["If-None-Match"] = cached[0]
     try:
-        response = requests.post(url, json=payload, timeout=2)
-        return response.status_code, response.json()
+        # requests already sends Accept-Encoding: gzip, deflate and decodes the body
+        response = requests.post(url, json=payload, headers=headers, timeout=2)
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag and response.status_code == 200 and endpoint in CONDITIONAL_ENDPOINTS:
+            with _etag_lock:
+                _etag_cache.pop(cache_key, None)
+                _etag_cache[cache_key] = (etag, data)
+                while len(_etag_cache) > ETAG_CACHE_MAX:
+                    _etag_cache.pop(next(iter(_etag_cache)))
+        return response.status_code, data
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         print(f"⚠️ API unreachable ({endpoint}). Switching to Offline DB Mode.")
         return execute_offline_db(endpoint, payload)
@@ -67,6 +101,26 @@ async def db_query_fallback(endpoint, payload):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, _db_query_fallback_sync, endpoint, payload)
 
+# Offline endpoints that modify licenses/blacklist
+OFFLINE_WRITE_ENDPOINTS = {"/generate", "/link_discord", "/blacklist/manage", "/ban_key", "/reset_batch", "/recover_key", "/delete_batch"}
+
+def revoke_offline(c, keys=(), hwids=()):
+    # Leases already handed out must stop working too; the server picks these
+    # rows up from lease_revocations (see leases.py). Committed by the caller.
+    leases.create_table(c)
+    leases.revoke(c, keys=keys, hwids=hwids)
+
+_server_cache = None
+
+def bump_server_cache():
+    # Writes behind the server's back: invalidate its shared /verify cache.
+    # Opened once and kept, it holds a file descriptor and a mapping.
+    global _server_cache
+    if _server_cache is None:
+        _server_cache = shmcache.open_cache(DB_FILE)
+    if _server_cache:
+        _server_cache.bump_all()
+
 def execute_offline_db(endpoint, payload):
     """Executes the equivalent SQL logic for supported endpoints."""
     try:
@@ -137,6 +191,21 @@ def execute_offline_db(endpoint, payload):
                 keys.append(k)
             response = {"keys": keys}
 
+        # --- KEY SEARCH ---
+        elif endpoint == "/keys/search":
+            limit = min(payload.get('limit', 100), 500)
+            try:
+                rows, next_offset = keyfilter.search(c, payload, limit, int(payload.get('after') or 0))
+                response = {"keys": [dict(row) for row in rows], "next": str(next_offset) if next_offset else None}
+            except ValueError as e:
+                status = 400
+                response = {"error": str(e)}
+
+        # --- KEY LOOKUP ---
+        elif endpoint == "/keys/lookup":
+            rows, total = fulltext.lookup(c, (payload.get('query') or "").strip(), min(payload.get('limit', 100), 500))
+            response = {"keys": [dict(row) for row in rows], "total": total}
+
         # --- PCREDIT BALANCE ---
         elif endpoint == "/pcredit/balance":
             discord_id = payload.get('discord_id')
@@ -212,6 +281,7 @@ def execute_offline_db(endpoint, payload):
                     response = {"error": "Missing HWID"}
                 else:
                     c.execute("INSERT OR IGNORE INTO blacklist (hwid, reason) VALUES (?, ?)", (hwid, reason))
+                    revoke_offline(c, hwids=[hwid])
                     conn.commit()
                     response = {"success": True, "message": f"HWID {hwid} blacklisted."}
             elif action == 'remove':
@@ -230,6 +300,7 @@ def execute_offline_db(endpoint, payload):
             reason = payload.get('reason', 'Banned')
             for k in keys_to_ban:
                 c.execute("UPDATE licenses SET status='banned', note=note || ? WHERE key_code=?", (f" [BANNED: {reason}]", k))
+            revoke_offline(c, keys=keys_to_ban)
             conn.commit()
             response = {"success": True, "message": f"Banned {len(keys_to_ban)} keys."}
 
@@ -263,6 +334,7 @@ def execute_offline_db(endpoint, payload):
             keys_to_reset = payload.get('keys', [])
             for k in keys_to_reset:
                 c.execute("UPDATE licenses SET hwid=NULL, status='unused', device_name=NULL, ip_address=NULL, last_seen=NULL WHERE key_code=?", (k,))
+            revoke_offline(c, keys=keys_to_reset)
             conn.commit()
             response = {"success": True, "message": f"Reset {len(keys_to_reset)} keys."}
 
@@ -280,6 +352,7 @@ def execute_offline_db(endpoint, payload):
             keys_to_delete = payload.get('keys', [])
             for k in keys_to_delete:
                 c.execute("DELETE FROM licenses WHERE key_code=?", (k,))
+            revoke_offline(c, keys=keys_to_delete)
             conn.commit()
             response = {"success": True, "message": f"Deleted {len(keys_to_delete)} keys."}
 
@@ -288,6 +361,8 @@ def execute_offline_db(endpoint, payload):
             response = {"error": f"Endpoint {endpoint} not supported in Offline Mode"}
 
         conn.close()
+        if endpoint in OFFLINE_WRITE_ENDPOINTS:
+            bump_server_cache()
         return status, response
     except Exception as e:
         return 500, {"error": f"Offline DB Error: {e}"}
@@ -310,6 +385,7 @@ class MyBot(commands.Bot):
         self.add_view(PurchaseView())
         self.add_view(TicketView())
         self.add_view(RedeemSystemView())
+        self.loop.create_task(server_event_consumer())
         print("Bot setup complete. Run '!sync' in your server to enable slash commands.")
 
 bot = MyBot()
@@ -512,7 +588,7 @@ user_reset_last = {}
 @bot.tree.command(name="mykeys", description="View your keys")
 async def mykeys(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    payload = {"discord_id": str(interaction.user.id), "admin_secret": ADMIN_SECRET}
+    payload = {"discord_id": str(interaction.user.id), "admin_secret": ADMIN_SECRET, "all": True}
     status, data = await db_query_fallback("/get_user_keys", payload)
     keys = data.get("keys", [])
     embed = discord.Embed(title="Your Keys", color=discord.Color.blurple())
@@ -537,7 +613,7 @@ async def mykeys(interaction: discord.Interaction):
 @bot.tree.command(name="status", description="Show your license status")
 async def status_cmd(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    payload = {"discord_id": str(interaction.user.id), "admin_secret": ADMIN_SECRET}
+    payload = {"discord_id": str(interaction.user.id), "admin_secret": ADMIN_SECRET, "all": True}
     status, data = await db_query_fallback("/get_user_keys", payload)
     keys = data.get("keys", [])
     total = len(keys)
@@ -575,7 +651,7 @@ async def reset_hwid(interaction: discord.Interaction, key: str = None):
         remain = 3600 - (now - last)
         await interaction.followup.send(f"Please wait {remain//60}m before requesting another reset.", ephemeral=True)
         return
-    payload = {"discord_id": uid, "admin_secret": ADMIN_SECRET}
+    payload = {"discord_id": uid, "admin_secret": ADMIN_SECRET, "all": True}
     status, data = await db_query_fallback("/get_user_keys", payload)
     keys = data.get("keys", [])
     owned = []
@@ -1549,7 +1625,8 @@ class UserDashboardView(View):
         try:
             payload = {
                 "admin_secret": ADMIN_SECRET,
-                "discord_id": str(interaction.user.id)
+                "discord_id": str(interaction.user.id),
+                "all": True
             }
             status, data = await db_query_fallback("/get_user_keys", payload)
             
@@ -1842,7 +1919,7 @@ class KeyManagementView(View):
     async def refresh(self, interaction):
         # Re-fetch keys
         try:
-            status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET})
+            status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET, "limit": 25})
             if status == 200:
                 new_keys = data.get("keys", [])
                 new_user_map = await resolve_users_map(interaction, new_keys)
@@ -2021,10 +2098,9 @@ async def blacklist(interaction: discord.Interaction, action: app_commands.Choic
             if not target_hwid and key:
                 # Fetch key info to find HWID
                 try:
-                    status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET})
+                    status, data = await db_query_fallback("/keys/search", {"admin_secret": ADMIN_SECRET, "key_code": key, "limit": 1})
                     if status == 200:
-                        all_keys = data.get("keys", [])
-                        found_key = next((k for k in all_keys if k['key_code'] == key), None)
+                        found_key = next(iter(data.get("keys", [])), None)
                         if found_key:
                             target_hwid = found_key.get('hwid')
                             if not target_hwid:
@@ -2045,13 +2121,14 @@ async def blacklist(interaction: discord.Interaction, action: app_commands.Choic
             "admin_secret": ADMIN_SECRET,
             "action": action.value,
             "hwid": target_hwid,
-            "reason": reason
+            "reason": reason,
+            "encoding": "columns"
         }
         status, data = await db_query_fallback("/blacklist/manage", payload)
         
         if status == 200:
             if action.value == 'list':
-                bl_list = data.get("blacklist", [])
+                bl_list = columnar.decode(data, "blacklist")
                 if not bl_list:
                     await interaction.followup.send("📋 Blacklist is empty.")
                 else:
@@ -2092,7 +2169,8 @@ async def infocheck(interaction: discord.Interaction, user: discord.User):
     try:
         payload = {
             "admin_secret": ADMIN_SECRET,
-            "discord_id": str(user.id)
+            "discord_id": str(user.id),
+            "all": True
         }
         # Use fallback for offline support
         status, data = await db_query_fallback("/get_user_keys", payload)
@@ -2170,7 +2248,8 @@ async def infocheck_text(ctx, user: discord.User = None):
         try:
             payload = {
                 "admin_secret": ADMIN_SECRET,
-                "discord_id": str(user.id)
+                "discord_id": str(user.id),
+                "all": True
             }
             status, data = await db_query_fallback("/get_user_keys", payload)
             
@@ -2404,8 +2483,8 @@ async def banuser(interaction: discord.Interaction, user: discord.Member, reason
         return
     
     try:
-        # 1. Get all keys
-        status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET})
+        # 1. Get the user's keys
+        status, data = await db_query_fallback("/get_user_keys", {"admin_secret": ADMIN_SECRET, "discord_id": str(user.id), "all": True})
         if status != 200:
             await interaction.followup.send("❌ Failed to fetch keys.")
             return
@@ -2473,19 +2552,11 @@ async def lookup(interaction: discord.Interaction, query: str):
         return
     
     try:
-        status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET})
+        # Ranked server-side search (full-text index over key, device name and note)
+        status, data = await db_query_fallback("/keys/lookup", {"admin_secret": ADMIN_SECRET, "query": query, "limit": 10})
         if status == 200:
-            keys = data.get("keys", [])
-            # Search matches (Case-insensitive)
-            query_lower = query.lower()
-            matches = []
-            for k in keys:
-                k_code = k['key_code'].lower()
-                k_device = (k['device_name'] or "").lower()
-                k_note = (k.get('note') or "").lower()
-                
-                if query_lower in k_code or query_lower in k_device or query_lower in k_note:
-                    matches.append(k)
+            matches = data.get("keys", [])
+            total = data.get("total", len(matches))
             
             if not matches:
                 await interaction.followup.send(f"🔍 No matches found for `{query}`.\n*(Searched Keys, Device Names, and Notes)*")
@@ -2497,10 +2568,12 @@ async def lookup(interaction: discord.Interaction, query: str):
                 info += f"\n**Runs:** {k.get('run_count', 0)}"
                 if k.get('note'):
                     info += f"\n**Note:** {k['note']}"
+                if k.get('snippet'):
+                    info += f"\n**Match:** {k['snippet']}"
                 embed.add_field(name=f"🔑 {k['key_code']}", value=info, inline=False)
             
-            if len(matches) > 10:
-                embed.set_footer(text=f"Showing 10 of {len(matches)} results.")
+            if total > 10:
+                embed.set_footer(text=f"Showing 10 of {total} results.")
                 
             await interaction.followup.send(embed=embed)
         else:
@@ -2582,7 +2655,8 @@ async def managekeys(interaction: discord.Interaction):
 
     try:
         # Fetch keys
-        status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET})
+        # The panel only shows the newest 25 keys
+        status, data = await db_query_fallback("/list", {"admin_secret": ADMIN_SECRET, "limit": 25})
         if status == 200:
             keys = data.get("keys", [])
             user_map = await resolve_users_map(interaction, keys)
@@ -2623,6 +2697,7 @@ async def keystatus(interaction: discord.Interaction):
             lifetime = data.get("lifetime", 0)
             limited = data.get("limited", 0)
             created_24h = data.get("created_24h", 0)
+            online_now = data.get("online_now", 0)
             
             embed = discord.Embed(title="📊 System Statistics", color=discord.Color.dark_theme())
             
@@ -2638,6 +2713,9 @@ async def keystatus(interaction: discord.Interaction):
             
             # Row 4: Activity Summary
             embed.add_field(name="📅 Activity (24h)", value=f"**New Keys:** `+{created_24h}`", inline=False)
+
+            # Live concurrency from /heartbeat
+            embed.add_field(name="🟢 Online Now", value=f"`{online_now}` running instance(s)", inline=False)
             
             # Row 5: Recently Redeemed
             redeemed_list = data.get("recently_redeemed", [])
@@ -3112,6 +3190,36 @@ async def postredeem(interaction: discord.Interaction, channel: discord.TextChan
 
 bot.tree.add_command(pcredit_group)
 
+# --- SERVER EVENTS (in-process bus, see eventbus.py) ---
+async def server_event_consumer():
+    """Posts server events (activations, alerts, digests...) to the log channel over the gateway.
+    Only receives anything when server.py runs in this process (main.py); otherwise the server uses the webhook."""
+    await bot.wait_until_ready()
+    queue = eventbus.bus.attach(asyncio.get_running_loop())
+    print("✅ Server event bus attached (logs go through the bot).")
+    try:
+        while True:
+            events = [await queue.get()]
+            # Up to 10 embeds per message, like the webhook path
+            while len(events) < 10 and not queue.empty():
+                events.append(queue.get_nowait())
+
+            channel = None
+            try:
+                channel = bot.get_channel(int(load_config().get('log_channel_id')))
+            except (TypeError, ValueError):
+                pass
+            if channel is None:
+                eventbus.bus.deliver_fallback(events)
+                continue
+            try:
+                await channel.send(embeds=[discord.Embed.from_dict(e.embed) for e in events])
+            except Exception as e:
+                print(f"⚠️ Failed to post server events: {e}")
+                eventbus.bus.deliver_fallback(events)
+    finally:
+        eventbus.bus.detach()
+
 # Helper for logging embeds
 async def send_log_embed(guild, embed):
     config = load_config()
@@ -0,0 +1,29 @@
+import json
+
+try:
+    import orjson # Optional, noticeably faster on large listings
+except ImportError:
+    orjson = None
+
+# Compact encoding for bulk listings (/list, /get_user_keys, blacklist list).
+# Clients opt in with "encoding": "columns" and get
+#   {"columns": ["key_code", ...], "rows": [["KEY-...", ...], ...]}
+# instead of a list of objects repeating every column name per row.
+
+def to_columns(items):
+    """List of dicts (same keys, same order) -> {"columns": [...], "rows": [[...], ...]}."""
+    if not items:
+        return {"columns": [], "rows": []}
+    return {"columns": list(items[0]), "rows": [list(item.values()) for item in items]}
+
+def dumps(body):
+    if orjson:
+        return orjson.dumps(body)
+    return json.dumps(body, separators=(",", ":"), default=str)
+
+def decode(data, name):
+    """Returns the listing as a list of dicts, whichever encoding the server (or offline mode) answered with."""
+    if "columns" in data:
+        columns = data["columns"]
+        return [dict(zip(columns, row)) for row in data["rows"]]
+    return data.get(name, [])
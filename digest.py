@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+from collections import Counter
+
+import metrics
+
+# Session-start digest.
+# Returning-user launches are far too frequent for one webhook each, so they
+# are counted here and posted as a single summary embed per window.
+# Activations and HWID mismatches are not affected and still go out individually.
+
+DIGEST_INTERVAL = int(os.environ.get("SESSION_DIGEST_INTERVAL", 300)) # 0 = post every session
+TOP_N = 10
+MAX_DEVICES = 10000
+
+class SessionDigest:
+    def __init__(self, send):
+        # send(title, description, color, fields), i.e. server.send_discord_webhook
+        self.send = send
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._total = 0
+        self._users = Counter()
+        self._keys = Counter()
+        self._devices = set()
+        self._started = time.time()
+
+    def add(self, user, key, device):
+        with self._lock:
+            self._total += 1
+            self._users[user] += 1
+            self._keys[key] += 1
+            if len(self._devices) < MAX_DEVICES:
+                self._devices.add(device)
+        metrics.inc("session_digest_events")
+
+    def flush(self):
+        with self._lock:
+            if not self._total:
+                self._started = time.time()
+                return
+            total, users, keys, devices = self._total, self._users, self._keys, len(self._devices)
+            minutes = max(1, round((time.time() - self._started) / 60))
+            self._reset()
+
+        top_users = "\n".join(f"{u} — `{n}`" for u, n in users.most_common(TOP_N))
+        top_keys = "\n".join(f"{k} — `{n}`" for k, n in keys.most_common(TOP_N))
+        fields = [
+            {"name": "🚀 Sessions", "value": f"{total}", "inline": True},
+            {"name": "👥 Users", "value": f"{len(users)}", "inline": True},
+            {"name": "💻 Distinct Devices", "value": f"{devices}", "inline": True},
+            {"name": "🏆 Top Users", "value": top_users[:1024], "inline": False},
+            {"name": "🔑 Top Keys", "value": top_keys[:1024], "inline": False}
+        ]
+        self.send("🔵 Session Digest", f"{total} session(s) started in the last {minutes} min.", 3447003, fields) # Blue
+
+    def start(self):
+        def loop():
+            while True:
+                time.sleep(DIGEST_INTERVAL)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"[Digest] Flush failed: {e}")
+        threading.Thread(target=loop, name="session-digest", daemon=True).start()
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from collections import namedtuple
+
+import metrics
+
+# In-process bus from the Flask server to the Discord bot.
+# When main.py runs both in one process, the bot attaches its event loop and
+# server events are handed over in memory and posted on the bot's gateway
+# connection, with no webhook round trip. If nothing is attached (server
+# and bot in separate processes) publish() returns False and the caller
+# uses the webhook instead.
+
+# kind: "activation", "session_digest", "mismatch", "sharing", "batch_verify", "keys_expired", "log"
+# embed: Discord embed dict (title, description, color, fields, timestamp, footer)
+ServerEvent = namedtuple("ServerEvent", "kind embed")
+
+MAX_PENDING = 1000
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+        # Called with an embed when the bot cannot deliver (server registers the webhook path)
+        self.fallback = None
+        metrics.register_gauge("eventbus_pending", self.pending)
+
+    def attach(self, loop):
+        """Called from the bot's loop; returns the asyncio.Queue to consume ServerEvents from."""
+        with self._lock:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=MAX_PENDING)
+            return self._queue
+
+    def detach(self):
+        with self._lock:
+            self._loop = None
+            self._queue = None
+
+    def attached(self):
+        return self._loop is not None and not self._loop.is_closed()
+
+    def pending(self):
+        q = self._queue
+        return q.qsize() if q else 0
+
+    def publish(self, event):
+        """Thread-safe. Returns False if no consumer is attached (caller should fall back)."""
+        with self._lock:
+            loop, q = self._loop, self._queue
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            loop.call_soon_threadsafe(self._offer, q, event)
+        except RuntimeError:
+            return False # Loop shut down between the check and the call
+        metrics.inc("eventbus_published")
+        return True
+
+    def _offer(self, q, event):
+        # Runs on the bot loop
+        try:
+            q.put_nowait(event)
+        except asyncio.QueueFull:
+            metrics.inc("eventbus_overflow")
+            self.deliver_fallback([event])
+
+    def deliver_fallback(self, events):
+        if not self.fallback:
+            metrics.inc("eventbus_dropped", len(events))
+            return
+        for event in events:
+            self.fallback(event.embed)
+
+bus = EventBus()
@@ -0,0 +1,103 @@
+import heapq
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Background expiry of timed keys.
+# Upcoming expirations within HORIZON seconds sit in a min-heap; the sweeper
+# thread sleeps until the earliest one is due, flips it to 'expired' and
+# reports it. Keys further out are picked up by an indexed range query on
+# (status, expires_epoch) when the horizon advances, so there is never a
+# full-table scan and a restart only reloads one window.
+
+HORIZON = 6 * 3600
+
+class ExpirySweeper:
+    def __init__(self, db_file, on_expire):
+        self.db_file = db_file
+        # Called with a list of (key_code, discord_id) after they were flipped
+        self.on_expire = on_expire
+        self._heap = []
+        self._cond = threading.Condition()
+        self._loaded_until = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._reload(int(time.time()))
+        self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+        self._thread.start()
+
+    def schedule(self, key_code, expires_epoch):
+        # Keys beyond the loaded window are found by the next range query
+        if not expires_epoch or expires_epoch > self._loaded_until:
+            return
+        with self._cond:
+            heapq.heappush(self._heap, (expires_epoch, key_code))
+            if self._heap[0][1] == key_code:
+                self._cond.notify()
+
+    def size(self):
+        return len(self._heap)
+
+    def _reload(self, now):
+        conn = sqlite3.connect(self.db_file)
+        c = conn.cursor()
+        until = now + HORIZON
+        # Small overlap with the previous window covers activations committed mid-reload;
+        # duplicates are harmless since _expire only flips rows that are still 'used'
+        c.execute("SELECT key_code, expires_epoch FROM licenses WHERE status='used' AND expires_epoch > ? AND expires_epoch <= ?",
+                  (self._loaded_until - 60, until))
+        rows = c.fetchall()
+        conn.close()
+        with self._cond:
+            for key_code, epoch in rows:
+                heapq.heappush(self._heap, (epoch, key_code))
+            self._loaded_until = until
+
+    def _run(self):
+        # Anything that already expired while we were down is expired immediately
+        while True:
+            try:
+                self._sweep_once()
+            except Exception as e:
+                print(f"[Expiry] Sweep failed: {e}")
+                time.sleep(5)
+
+    def _sweep_once(self):
+        with self._cond:
+            now = time.time()
+            wait = self._loaded_until - HORIZON / 2 - now
+            if self._heap:
+                wait = min(wait, self._heap[0][0] - now)
+            if wait > 0:
+                self._cond.wait(wait)
+                return
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+
+        if self._loaded_until - HORIZON / 2 <= now:
+            self._reload(int(now))
+        if due:
+            self._expire(due, int(now))
+
+    def _expire(self, due, now):
+        conn = sqlite3.connect(self.db_file)
+        c = conn.cursor()
+        expired = []
+        for epoch, key_code in due:
+            # Guard against keys that were reset/extended since they were queued
+            c.execute("UPDATE licenses SET status='expired' WHERE key_code=? AND status='used' AND expires_epoch <= ?", (key_code, now))
+            if c.rowcount:
+                c.execute("SELECT discord_id FROM licenses WHERE key_code=?", (key_code,))
+                row = c.fetchone()
+                expired.append((key_code, row[0] if row else None))
+        conn.commit()
+        conn.close()
+        if expired:
+            metrics.inc("keys_expired", len(expired))
+            self.on_expire(expired)
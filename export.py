@@ -0,0 +1,63 @@
+import io
+import csv
+import json
+import zlib
+
+# Streaming encoders for /export. Rows are pulled from the SQLite cursor in
+# small batches and encoded as they go, so memory stays flat however large
+# the licenses table is.
+
+FETCH_BATCH = 500
+# Flush gzip output at least this often so the client sees steady progress
+GZIP_FLUSH_BYTES = 64 * 1024
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def iter_rows(conn, c):
+    """Yields rows from an executed cursor, closing the connection when done (or abandoned)."""
+    try:
+        while True:
+            rows = c.fetchmany(FETCH_BATCH)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        conn.close()
+
+def encode_ndjson(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), default=str) + "\n"
+
+def encode_csv(columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= 8192:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def gzip_chunks(chunks):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31: gzip container
+    pending = 0
+    for chunk in chunks:
+        raw = chunk.encode()
+        pending += len(raw)
+        out = comp.compress(raw)
+        if pending >= GZIP_FLUSH_BYTES:
+            out += comp.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield comp.flush()
+
+def stream(conn, c, fmt, gzip=False):
+    columns = [d[0] for d in c.description]
+    rows = iter_rows(conn, c)
+    chunks = encode_csv(columns, rows) if fmt == "csv" else encode_ndjson(columns, rows)
+    if gzip:
+        return gzip_chunks(chunks)
+    return (chunk.encode() for chunk in chunks)
@@ -0,0 +1,64 @@
+import sqlite3
+
+# Substring search over key_code, device_name and note.
+# licenses_fts is an FTS5 table with the trigram tokenizer (any 3+ character
+# substring hits the index). It keeps its own copy of the three columns and
+# joins back to licenses on key_code: licenses has a TEXT primary key, so its
+# implicit rowids may be renumbered by VACUUM and cannot be used as the link.
+# Triggers keep it in sync; only inserts, deletes and edits of the three
+# indexed columns touch it, not /verify's session updates. Sync rows are
+# found through the index itself (a key_code phrase match), so generated
+# keys (always 3+ characters) never cost a scan.
+# Needs SQLite 3.34+ built with FTS5; without it lookups fall back to LIKE.
+
+MIN_QUERY_CHARS = 3 # Shortest query the trigram index can answer
+SNIPPET_TOKENS = 32 # trigram tokens, i.e. roughly characters
+
+_DELETE_OLD = ("DELETE FROM licenses_fts WHERE rowid IN (SELECT rowid FROM licenses_fts "
+               "WHERE licenses_fts MATCH 'key_code : \"' || replace(old.key_code, '\"', '\"\"') || '\"') "
+               "AND key_code = old.key_code; ")
+_INSERT_NEW = "INSERT INTO licenses_fts (key_code, device_name, note) VALUES (new.key_code, new.device_name, new.note); "
+
+TRIGGERS = [
+    ("trg_licenses_fts_ins", "AFTER INSERT ON licenses BEGIN " + _INSERT_NEW + "END"),
+    ("trg_licenses_fts_del", "AFTER DELETE ON licenses BEGIN " + _DELETE_OLD + "END"),
+    ("trg_licenses_fts_upd", "AFTER UPDATE OF key_code, device_name, note ON licenses BEGIN " + _DELETE_OLD + _INSERT_NEW + "END"),
+]
+
+def setup(c):
+    """Creates (and on first run backfills) the index. Returns False if this SQLite lacks FTS5/trigram."""
+    exists = available(c)
+    try:
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS licenses_fts USING fts5
+                     (key_code, device_name, note, tokenize='trigram')''')
+    except sqlite3.OperationalError as e:
+        print(f"[Search] Full-text index unavailable, using LIKE: {e}")
+        return False
+    for name, body in TRIGGERS:
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    if not exists:
+        c.execute("INSERT INTO licenses_fts (key_code, device_name, note) SELECT key_code, device_name, note FROM licenses")
+    return True
+
+def available(c):
+    return c.execute("SELECT 1 FROM sqlite_master WHERE name='licenses_fts'").fetchone() is not None
+
+def lookup(c, query, limit):
+    """
+    Returns (rows, total) for licenses whose key_code, device_name or note contain `query`.
+    With the index, rows are ranked by bm25 and carry a `snippet` (matches in **bold**).
+    """
+    if len(query) >= MIN_QUERY_CHARS and available(c):
+        phrase = '"' + query.replace('"', '""') + '"'
+        total = c.execute("SELECT COUNT(*) FROM licenses_fts WHERE licenses_fts MATCH ?", (phrase,)).fetchone()[0]
+        c.execute(f'''SELECT licenses.*, snippet(licenses_fts, -1, '**', '**', '…', {SNIPPET_TOKENS}) AS snippet
+                      FROM licenses_fts JOIN licenses ON licenses.key_code = licenses_fts.key_code
+                      WHERE licenses_fts MATCH ? ORDER BY rank LIMIT ?''', (phrase, limit))
+        return c.fetchall(), total
+
+    # Short query (or no FTS5): scan; the table is read once either way
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    where = "key_code LIKE ? ESCAPE '\\' OR device_name LIKE ? ESCAPE '\\' OR note LIKE ? ESCAPE '\\'"
+    total = c.execute(f"SELECT COUNT(*) FROM licenses WHERE {where}", (pattern,) * 3).fetchone()[0]
+    c.execute(f"SELECT *, NULL AS snippet FROM licenses WHERE {where} ORDER BY created_at DESC LIMIT ?", (pattern,) * 3 + (limit,))
+    return c.fetchall(), total
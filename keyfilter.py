@@ -0,0 +1,104 @@
+# Structured license filters, turned into a parameterised WHERE clause.
+# Shared by the server (/keys/search) and the bot's offline mode so both run
+# the same SQL. Filters map onto indexed columns where there is one
+# (status/expires_epoch, discord_id, hwid, note, created_at).
+
+STATUSES = {"unused", "used", "banned", "expired"}
+SORT_COLUMNS = {"created_at", "expires_epoch", "redeemed_at", "last_seen", "run_count", "key_code"}
+
+# filter name -> column, compared with =
+EXACT_FILTERS = {
+    "key_code": "key_code",
+    "discord_id": "discord_id",
+    "hwid": "hwid",
+    "ip_address": "ip_address",
+    "note": "note",
+}
+# filter name -> (column, operator)
+RANGE_FILTERS = {
+    "created_after": ("created_at", ">="),
+    "created_before": ("created_at", "<"),
+    "redeemed_after": ("redeemed_at", ">="),
+    "redeemed_before": ("redeemed_at", "<"),
+    "expires_after": ("expires_epoch", ">="),
+    "expires_before": ("expires_epoch", "<"),
+    "min_runs": ("run_count", ">="),
+    "max_runs": ("run_count", "<="),
+}
+INT_FILTERS = {"expires_after", "expires_before", "min_runs", "max_runs"}
+
+def build_where(filters):
+    """
+    Returns (where_sql, params) for a dict of filters ("" if none apply).
+    Raises ValueError on an invalid filter value.
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("filter must be an object")
+    where, params = [], []
+
+    status = filters.get('status')
+    if status is not None and status != "":
+        if isinstance(status, str):
+            statuses = [status]
+        elif isinstance(status, list) and status and all(isinstance(s, str) for s in status):
+            statuses = status
+        else:
+            raise ValueError("status must be a string or a non-empty list of strings")
+        if not set(statuses) <= STATUSES:
+            raise ValueError(f"status must be one of {', '.join(sorted(STATUSES))}")
+        where.append(f"status IN ({','.join('?' for _ in statuses)})")
+        params.extend(statuses)
+
+    for name, column in EXACT_FILTERS.items():
+        if filters.get(name) is not None:
+            if not isinstance(filters[name], (str, int, float)):
+                raise ValueError(f"{name} must be a string or number")
+            where.append(f"{column}=?")
+            params.append(str(filters[name]))
+
+    for name, (column, op) in RANGE_FILTERS.items():
+        value = filters.get(name)
+        if value is None:
+            continue
+        if name in INT_FILTERS and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(f"{name} must be an integer")
+        if not isinstance(value, (str, int, float)):
+            raise ValueError(f"{name} must be a string or number")
+        where.append(f"{column} {op} ?")
+        params.append(value)
+
+    duration = filters.get('duration')
+    if duration == "lifetime":
+        where.append("duration_hours = 0")
+    elif duration == "limited":
+        where.append("duration_hours > 0")
+    elif duration is not None:
+        raise ValueError("duration must be 'lifetime' or 'limited'")
+
+    return " AND ".join(where), params
+
+def build_order(sort, order):
+    """Returns the ORDER BY clause; key_code breaks ties so pages are stable."""
+    sort = sort or "created_at"
+    order = (order or "desc").lower()
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(sorted(SORT_COLUMNS))}")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+    if sort == "key_code":
+        return f"key_code {order.upper()}"
+    return f"{sort} {order.upper()}, key_code {order.upper()}"
+
+def search(c, filters, limit, offset=0):
+    """Runs a search on cursor `c`. Returns (rows, next_offset or None)."""
+    where, params = build_where(filters)
+    sql = "SELECT * FROM licenses"
+    if where:
+        sql += f" WHERE {where}"
+    sql += f" ORDER BY {build_order(filters.get('sort'), filters.get('order'))} LIMIT ? OFFSET ?"
+    # One extra row tells us whether there is a next page
+    c.execute(sql, params + [limit + 1, offset])
+    rows = c.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], offset + limit
@@ -0,0 +1,189 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import sqlite3
+import secrets
+import threading
+
+# Signed license leases.
+# /verify hands out a short token (HMAC over key, hwid, discord_id, expiry)
+# that the client presents on later launches to /verify_lease. Checking it
+# needs no DB access: only the signature, the expiry and the in-memory
+# revocation set below.
+#
+# Revocations are also written to the lease_revocations table. Writers that
+# are not this process (the bot's offline mode, another worker) only touch
+# the DB, so check_lease re-reads the table when db_meta.state_version has
+# moved, looking at most every REFRESH_INTERVAL seconds.
+
+# Lifetime of a lease in seconds (0 disables leases)
+LEASE_TTL_SECONDS = int(os.environ.get("LEASE_TTL_SECONDS", 6 * 3600))
+# Without LEASE_SECRET, load_secret() shares a generated one between all
+# workers through a file next to the DB; until then (or if that file cannot
+# be written) leases are signed with a random per-process secret.
+LEASE_SECRET = os.environ.get("LEASE_SECRET")
+_secret_from_env = bool(LEASE_SECRET)
+if not LEASE_SECRET:
+    LEASE_SECRET = secrets.token_hex(32)
+
+_lock = threading.Lock()
+# Revocation epoch: milliseconds, strictly increasing, so it stays monotonic across restarts
+_epoch = 0
+# subject ("key:<code>" / "hwid:<hwid>") -> epoch it was revoked at
+_revoked = {}
+
+REFRESH_INTERVAL = 1.0
+_db_file = None
+_seen_version = None
+_next_refresh = 0.0
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _unb64(text):
+    padding = "=" * (-len(text) % 4)
+    return base64.urlsafe_b64decode((text + padding).encode())
+
+def _sign(body):
+    return hmac.new(LEASE_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+
+def next_epoch():
+    global _epoch
+    with _lock:
+        _epoch = max(_epoch + 1, int(time.time() * 1000))
+        return _epoch
+
+def issue_lease(key, hwid, discord_id, key_expires_at=None):
+    """
+    Returns (token, expires_at_unix) or (None, None) if leases are disabled.
+    key_expires_at (unix seconds) caps the lease for timed keys.
+    """
+    if LEASE_TTL_SECONDS <= 0:
+        return None, None
+    expires = int(time.time()) + LEASE_TTL_SECONDS
+    if key_expires_at:
+        expires = min(expires, int(key_expires_at))
+    body = _b64(json.dumps([key, hwid, discord_id, expires, next_epoch()], separators=(",", ":")).encode())
+    return f"{body}.{_b64(_sign(body))}", expires
+
+def check_lease(token, hwid):
+    """Returns (payload_dict, None) if the lease is valid, else (None, reason)."""
+    try:
+        body, sig = token.split(".")
+        if not hmac.compare_digest(_unb64(sig), _sign(body)):
+            return None, "Invalid lease"
+        key, lease_hwid, discord_id, expires, epoch = json.loads(_unb64(body))
+    except Exception:
+        return None, "Invalid lease"
+
+    if lease_hwid != hwid:
+        return None, "Invalid lease"
+    if time.time() >= expires:
+        return None, "Lease expired"
+    _refresh()
+    if _revoked.get(f"key:{key}", 0) >= epoch or _revoked.get(f"hwid:{hwid}", 0) >= epoch:
+        return None, "Lease revoked"
+    return {"key": key, "hwid": hwid, "discord_id": discord_id, "expires_at": expires}, None
+
+def load_secret(path):
+    """Reads the generated signing secret at `path`, creating it if no worker has yet (called from init_db)."""
+    global LEASE_SECRET
+    if _secret_from_env:
+        return
+    try:
+        if not os.path.exists(path):
+            # Written aside and linked into place: the first worker wins and nobody reads a half-written file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        with open(path, "r") as f:
+            secret = f.read().strip()
+        if not secret:
+            raise OSError(f"{path} is empty")
+        LEASE_SECRET = secret
+    except OSError as e:
+        # Leases then only verify on this process until the next restart;
+        # clients just fall back to a full /verify when that happens.
+        print(f"[Lease] LEASE_SECRET not set and {path} unusable, using a random per-process secret: {e}")
+
+def create_table(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS lease_revocations
+                 (subject TEXT PRIMARY KEY, 
+                  epoch INTEGER)''')
+
+def revoke(c, keys=(), hwids=()):
+    """
+    Revokes every lease issued so far for the given keys/hwids.
+    Persisted through cursor `c` (committed by the caller) so revocations survive restarts.
+    """
+    subjects = [f"key:{k}" for k in keys if k] + [f"hwid:{h}" for h in hwids if h]
+    if not subjects:
+        return
+    epoch = next_epoch()
+    with _lock:
+        for s in subjects:
+            _revoked[s] = epoch
+    c.executemany("INSERT OR REPLACE INTO lease_revocations (subject, epoch) VALUES (?, ?)",
+                  [(s, epoch) for s in subjects])
+    _prune()
+
+def load_revocations(conn, db_file):
+    """Loads revocations younger than the lease lifetime into memory and watches db_file for more (called from init_db)."""
+    global _db_file, _seen_version
+    c = conn.cursor()
+    cutoff = int((time.time() - max(LEASE_TTL_SECONDS, 0)) * 1000)
+    c.execute("DELETE FROM lease_revocations WHERE epoch < ?", (cutoff,))
+    c.execute("SELECT subject, epoch FROM lease_revocations")
+    _merge(c.fetchall())
+    row = c.execute("SELECT value FROM db_meta WHERE name='state_version'").fetchone()
+    _seen_version = row[0] if row else None
+    _db_file = db_file
+
+def _merge(rows):
+    global _epoch
+    with _lock:
+        for subject, epoch in rows:
+            if epoch > _revoked.get(subject, 0):
+                _revoked[subject] = epoch
+            _epoch = max(_epoch, epoch)
+
+def _refresh():
+    # Picks up revocations written by other processes (see top of file)
+    global _seen_version, _next_refresh
+    now = time.monotonic()
+    if not _db_file or now < _next_refresh:
+        return
+    _next_refresh = now + REFRESH_INTERVAL
+    try:
+        conn = sqlite3.connect(_db_file)
+        try:
+            row = conn.execute("SELECT value FROM db_meta WHERE name='state_version'").fetchone()
+            version = row[0] if row else None
+            if version == _seen_version:
+                return
+            cutoff = int((time.time() - max(LEASE_TTL_SECONDS, 0)) * 1000)
+            _merge(conn.execute("SELECT subject, epoch FROM lease_revocations WHERE epoch >= ?", (cutoff,)).fetchall())
+            _seen_version = version
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[Lease] Revocation refresh failed: {e}")
+
+def _prune():
+    # Leases issued before now - TTL are expired anyway, so older revocations can go
+    cutoff = int((time.time() - LEASE_TTL_SECONDS) * 1000)
+    with _lock:
+        if len(_revoked) < 1024:
+            return
+        for s in [s for s, e in _revoked.items() if e < cutoff]:
+            del _revoked[s]
@@ -0,0 +1,67 @@
+import os
+import random
+import threading
+
+import metrics
+
+# Tracks how busy the server is and turns that into re-verification hints.
+# /verify responses carry `next_check_in` (seconds), which grows with load and
+# is jittered so clients restarted together drift apart instead of coming
+# back as one herd. Past the overload point /verify answers 503 + Retry-After.
+
+# Hint when idle, and the cap it grows to under load (seconds)
+BASE_CHECK_INTERVAL = int(os.environ.get("BASE_CHECK_INTERVAL", 300))
+MAX_CHECK_INTERVAL = int(os.environ.get("MAX_CHECK_INTERVAL", 3600))
+# Load reaches 1.0 (overloaded) at either of these. The threaded server has
+# no accept queue we can see, so in-flight requests stand in for queue depth.
+OVERLOAD_INFLIGHT = int(os.environ.get("OVERLOAD_INFLIGHT", 32))
+OVERLOAD_LATENCY_MS = int(os.environ.get("OVERLOAD_LATENCY_MS", 2000))
+JITTER = 0.2
+
+_lock = threading.Lock()
+_inflight = 0
+_latency_ewma = 0.0
+
+def request_started():
+    global _inflight
+    with _lock:
+        _inflight += 1
+
+def request_finished():
+    global _inflight
+    with _lock:
+        _inflight -= 1
+
+def record_latency(seconds):
+    global _latency_ewma
+    with _lock:
+        _latency_ewma = seconds if _latency_ewma == 0 else 0.9 * _latency_ewma + 0.1 * seconds
+
+def load_factor():
+    """0.0 = idle, >= 1.0 = overloaded."""
+    return max(
+        _inflight / OVERLOAD_INFLIGHT,
+        (_latency_ewma * 1000) / OVERLOAD_LATENCY_MS,
+    )
+
+def _jitter(seconds):
+    return int(seconds * random.uniform(1 - JITTER, 1 + JITTER))
+
+def next_check_in():
+    load = min(load_factor(), 1.0)
+    # Quadratic so light load barely changes the interval
+    interval = BASE_CHECK_INTERVAL + (MAX_CHECK_INTERVAL - BASE_CHECK_INTERVAL) * load * load
+    return _jitter(interval)
+
+def overload_retry_after():
+    """Seconds a client should wait if we are overloaded right now, else 0."""
+    load = load_factor()
+    if load < 1.0:
+        return 0
+    metrics.inc("verify_overload_rejected")
+    # Spread retries over up to a minute, longer the deeper we are in overload
+    return max(1, _jitter(min(60, 10 * load)))
+
+metrics.register_gauge("inflight_requests", lambda: _inflight)
+metrics.register_gauge("verify_latency_ewma_ms", lambda: round(_latency_ewma * 1000, 2))
+metrics.register_gauge("load_factor", lambda: round(load_factor(), 3))
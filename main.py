@@ -9,6 +9,7 @@ import bot
 def run_server():
     # Ensure database is initialized
     server.init_db()
+    server.start_background_workers()
     # Get port from environment variable (Required for Render/Heroku)
     port = int(os.environ.get("PORT", 5000))
     # Run Flask (blocking)
@@ -40,8 +41,9 @@ if __name__ == "__main__":
     keep_alive_thread.start()
     
     print("[System] API Server started on port 5000.")
-    print("[System] Waiting 3 seconds for server to initialize...")
-    time.sleep(3)
+    print("[System] Waiting for server warm-up to finish...")
+    if not server.server_ready.wait(timeout=60):
+        print("[System] Warm-up still running after 60s, starting bot anyway.")
     
     print("[System] Starting Discord Bot...")
     # Start Bot (Main Thread)
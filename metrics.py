@@ -0,0 +1,49 @@
+import threading
+
+# Process-wide counters/gauges, exported through the /metrics route in server.py.
+# Everything is in-memory and cheap enough to call on the /verify path.
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+# name -> zero-arg callable, read only when a snapshot is taken
+_gauges = {}
+
+def inc(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def observe(name, seconds):
+    # Keeps count / total / max per timing, enough for averages without storing samples
+    with _lock:
+        t = _timings.get(name)
+        if t is None:
+            t = _timings[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        t["count"] += 1
+        t["total"] += seconds
+        if seconds > t["max"]:
+            t["max"] = seconds
+
+def restore(counters):
+    # Seeds counters from a warm-start snapshot (warmup.py)
+    with _lock:
+        for name, value in counters.items():
+            _counters[name] = _counters.get(name, 0) + value
+
+def register_gauge(name, fn):
+    _gauges[name] = fn
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        timings = {}
+        for name, t in _timings.items():
+            avg = t["total"] / t["count"] if t["count"] else 0.0
+            timings[name] = {"count": t["count"], "avg_ms": round(avg * 1000, 2), "max_ms": round(t["max"] * 1000, 2)}
+    gauges = {}
+    for name, fn in list(_gauges.items()):
+        try:
+            gauges[name] = fn()
+        except Exception as e:
+            gauges[name] = f"error: {e}"
+    return {"counters": counters, "gauges": gauges, "timings": timings}
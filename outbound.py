@@ -0,0 +1,55 @@
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# Shared outbound HTTP client for server.py (Discord OAuth + webhooks).
+# One keep-alive pool instead of a new TLS handshake per call, a connect/read
+# timeout on every call so a slow Discord can never pin a Flask thread, and
+# bounded retries: connection failures always (nothing was sent), 5xx only
+# for idempotent methods. Latency per call name goes to /metrics.
+
+CONNECT_TIMEOUT = float(os.environ.get("OUTBOUND_CONNECT_TIMEOUT", 3))
+READ_TIMEOUT = float(os.environ.get("OUTBOUND_READ_TIMEOUT", 10))
+POOL_SIZE = int(os.environ.get("OUTBOUND_POOL_SIZE", 10))
+RETRIES = 2
+
+class OutboundClient:
+    def __init__(self):
+        self.session = requests.Session()
+        retry = Retry(
+            total=RETRIES,
+            connect=RETRIES,
+            read=RETRIES,
+            status=RETRIES,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, name, timeout=None, **kwargs):
+        """`name` labels the call in metrics (outbound_<name>)."""
+        start = time.monotonic()
+        try:
+            return self.session.request(method, url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+        except requests.RequestException:
+            metrics.inc(f"outbound_{name}_errors")
+            raise
+        finally:
+            metrics.observe(f"outbound_{name}", time.monotonic() - start)
+
+    def get(self, url, name, **kwargs):
+        return self.request("GET", url, name, **kwargs)
+
+    def post(self, url, name, **kwargs):
+        return self.request("POST", url, name, **kwargs)
+
+client = OutboundClient()
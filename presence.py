@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import datetime
+import threading
+import time
+
+import metrics
+
+# In-memory "who is online" table fed by /heartbeat.
+# Entries live in a timer wheel: one slot per TICK seconds, enough slots to
+# cover PRESENCE_TTL. A beat moves its entry into the current slot; when the
+# wheel turns onto a slot, everything still in it has not beaten for a full
+# TTL and is dropped. Beating and expiring are both O(1) per entry, and only
+# aggregates (plus a batched last_seen update) are written to disk.
+
+HEARTBEAT_INTERVAL = int(os.environ.get("HEARTBEAT_INTERVAL", 60))
+PRESENCE_TTL = int(os.environ.get("PRESENCE_TTL", 3 * HEARTBEAT_INTERVAL))
+TICK = 15
+FLUSH_INTERVAL = int(os.environ.get("PRESENCE_FLUSH_INTERVAL", 300))
+
+class PresenceTracker:
+    def __init__(self, ttl=PRESENCE_TTL, tick=TICK):
+        self.tick = tick
+        self.slots = max(2, -(-ttl // tick) + 1)
+        self._wheel = [set() for _ in range(self.slots)]
+        # (key, hwid) -> absolute tick of its last beat
+        self._where = {}
+        # key -> number of online (key, hwid) entries
+        self._per_key = {}
+        self._current = self._now_tick()
+        self._lock = threading.Lock()
+        self._beats = 0
+        self._peak = 0
+
+    def _now_tick(self):
+        return int(time.time() // self.tick)
+
+    def _advance(self):
+        now = self._now_tick()
+        # After a long gap every slot is stale; no need to turn the wheel more than once
+        steps = min(now - self._current, self.slots)
+        for i in range(1, steps + 1):
+            slot = self._wheel[(self._current + i) % self.slots]
+            for entry in slot:
+                del self._where[entry]
+                key = entry[0]
+                self._per_key[key] -= 1
+                if not self._per_key[key]:
+                    del self._per_key[key]
+            slot.clear()
+        self._current = max(self._current, now)
+
+    def beat(self, key, hwid):
+        entry = (key, hwid)
+        with self._lock:
+            self._advance()
+            old = self._where.get(entry)
+            if old is None:
+                self._per_key[key] = self._per_key.get(key, 0) + 1
+            else:
+                self._wheel[old % self.slots].discard(entry)
+            self._where[entry] = self._current
+            self._wheel[self._current % self.slots].add(entry)
+            self._beats += 1
+            if len(self._where) > self._peak:
+                self._peak = len(self._where)
+
+    def online_total(self):
+        with self._lock:
+            self._advance()
+            return len(self._where)
+
+    def online_for(self, key):
+        with self._lock:
+            self._advance()
+            return self._per_key.get(key, 0)
+
+    def online_keys(self):
+        with self._lock:
+            self._advance()
+            return dict(self._per_key)
+
+    def take_window(self):
+        """Returns (online_now, peak, beats) since the last call and resets the window."""
+        with self._lock:
+            self._advance()
+            online = len(self._where)
+            result = (online, max(self._peak, online), self._beats)
+            self._peak = online
+            self._beats = 0
+            return result
+
+tracker = PresenceTracker()
+metrics.register_gauge("online_now", tracker.online_total)
+
+def flush(db_file):
+    online, peak, beats = tracker.take_window()
+    keys = list(tracker.online_keys())
+    conn = sqlite3.connect(db_file)
+    c = conn.cursor()
+    c.execute("INSERT INTO presence_stats (online_now, online_peak, heartbeats) VALUES (?, ?, ?)", (online, peak, beats))
+    if keys:
+        # One batched write per window instead of one per heartbeat
+        now = datetime.datetime.now()
+        c.executemany("UPDATE licenses SET last_seen=? WHERE key_code=?", [(now, k) for k in keys])
+    conn.commit()
+    conn.close()
+
+def start_flusher(db_file):
+    def loop():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                flush(db_file)
+            except Exception as e:
+                print(f"[Presence] Flush failed: {e}")
+    threading.Thread(target=loop, name="presence-flusher", daemon=True).start()
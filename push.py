@@ -0,0 +1,86 @@
+import os
+import json
+import queue
+import threading
+import time
+
+import metrics
+
+# Revocation push channel.
+# Running clients hold an SSE stream open on /events for their key. Ban,
+# reset, delete and blacklist writes publish to it after they commit, and the
+# client re-verifies only when told to instead of polling /verify.
+
+MAX_CONNECTIONS = int(os.environ.get("SSE_MAX_CONNECTIONS", 200))
+MAX_PER_KEY = int(os.environ.get("SSE_MAX_PER_KEY", 4))
+HEARTBEAT_INTERVAL = 25
+
+class RevocationHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # "key:<code>" / "hwid:<hwid>" -> set of subscriber queues
+        self._subs = {}
+        self._count = 0
+
+    def subscribe(self, key, hwid):
+        """Returns a queue to read events from, or None if a connection limit is hit."""
+        q = queue.Queue(maxsize=16)
+        with self._lock:
+            if self._count >= MAX_CONNECTIONS or len(self._subs.get(f"key:{key}", ())) >= MAX_PER_KEY:
+                metrics.inc("sse_rejected")
+                return None
+            for topic in (f"key:{key}", f"hwid:{hwid}"):
+                self._subs.setdefault(topic, set()).add(q)
+            self._count += 1
+        q.topics = (f"key:{key}", f"hwid:{hwid}")
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            for topic in q.topics:
+                subs = self._subs.get(topic)
+                if subs is not None:
+                    subs.discard(q)
+                    if not subs:
+                        del self._subs[topic]
+            self._count -= 1
+
+    def publish(self, keys=(), hwids=(), reason="revoked"):
+        topics = [f"key:{k}" for k in keys if k] + [f"hwid:{h}" for h in hwids if h]
+        with self._lock:
+            targets = set()
+            for topic in topics:
+                targets |= self._subs.get(topic, set())
+        event = {"type": "revoked", "reason": reason, "at": int(time.time())}
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass # Client is not reading; it already has a re-verify pending
+        if targets:
+            metrics.inc("sse_pushed", len(targets))
+
+    def size(self):
+        return self._count
+
+    def stream(self, q, until):
+        """SSE generator for one subscriber; closes when the lease expires (`until`, unix seconds)."""
+        try:
+            yield "event: hello\ndata: {}\n\n"
+            while True:
+                remaining = until - time.time()
+                if remaining <= 0:
+                    yield 'event: expired\ndata: {"type": "lease_expired"}\n\n'
+                    return
+                try:
+                    event = q.get(timeout=min(HEARTBEAT_INTERVAL, remaining))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: revoked\ndata: {json.dumps(event)}\n\n"
+                return # Client re-verifies and reconnects with its new lease
+        finally:
+            self.unsubscribe(q)
+
+hub = RevocationHub()
+metrics.register_gauge("sse_connections", hub.size)
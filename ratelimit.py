@@ -0,0 +1,54 @@
+import math
+import time
+import threading
+
+# Token-bucket rate limiting for the /verify routes.
+# Buckets live in a fixed number of shards, each with its own lock, so
+# concurrent Flask threads rarely contend. Idle buckets are evicted once
+# they would have refilled completely, since a full bucket is the same as
+# no bucket at all.
+
+class TokenBucketLimiter:
+    def __init__(self, per_minute, burst, shards=16):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+        # A bucket idle this long is full again and can be dropped
+        self.idle_ttl = self.burst / self.rate if self.rate > 0 else 3600.0
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._next_sweep = [0.0] * shards
+
+    def enabled(self):
+        return self.rate > 0 and self.burst > 0
+
+    def acquire(self, ident, cost=1):
+        """Takes `cost` tokens for `ident`. Returns 0 if allowed, else seconds until it would be."""
+        if not self.enabled() or not ident:
+            return 0
+        idx = hash(ident) % len(self._shards)
+        buckets, lock = self._shards[idx]
+        now = time.monotonic()
+        with lock:
+            if now >= self._next_sweep[idx]:
+                self._sweep(buckets, now)
+                self._next_sweep[idx] = now + self.idle_ttl
+            bucket = buckets.get(ident)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= cost:
+                buckets[ident] = [tokens - cost, now]
+                return 0
+            buckets[ident] = [tokens, now]
+            return (cost - tokens) / self.rate
+
+    def _sweep(self, buckets, now):
+        stale = [k for k, b in buckets.items() if now - b[1] >= self.idle_ttl]
+        for k in stale:
+            del buckets[k]
+
+    def size(self):
+        return sum(len(b) for b, _ in self._shards)
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
@@ -3,10 +3,37 @@ import uuid
 import secrets
 import datetime
 import json
+import atexit
 import os
+import time
 import base64
+import hashlib
+import zlib
+import threading
 import requests
-from flask import Flask, request, jsonify, redirect
+import leases
+import metrics
+import load_monitor
+from admission import admin_gate
+from expiry import ExpirySweeper
+import presence
+import sharing
+from push import hub as push_hub
+import shmcache
+import warmup
+from webhooks import WebhookDispatcher, clean_fields
+import digest
+import outbound
+import eventbus
+import fulltext
+import keyfilter
+import columnar
+import export
+import sessions
+from sessions import link_sessions
+from ratelimit import TokenBucketLimiter, retry_after_header
+from flask import Flask, request, jsonify, redirect, g, Response
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,14 +41,56 @@ DB_FILE = os.path.join(_BASE_DIR, "keys.db")
 ADMIN_SECRET = "CHANGE_THIS_TO_A_SECRET_PASSWORD"
 CONFIG_FILE = os.path.normpath(os.environ.get("BOT_CONFIG_PATH") or os.path.join(_BASE_DIR, "..", "bot_config.json"))
 DISCORD_API_BASE = "https://discord.com/api"
-link_sessions = {}
+# Cross-process /verify cache (shmcache.py), opened by init_db()
+shared_cache = None
+# Set once warm-up has finished (see warm_up below); /ready reports it
+server_ready = threading.Event()
+_warm_snapshot = None
+
+# Number of reverse proxies in front of us whose X-Forwarded-For we trust (1 on Render).
+# With 0, request.remote_addr is the direct peer and X-Forwarded-For is ignored.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1 if os.environ.get("RENDER") else 0))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+# /verify rate limits (requests per minute, burst). 0 disables a limiter.
+ip_limiter = TokenBucketLimiter(int(os.environ.get("RATE_LIMIT_IP_PER_MIN", 120)), int(os.environ.get("RATE_LIMIT_IP_BURST", 60)))
+hwid_limiter = TokenBucketLimiter(int(os.environ.get("RATE_LIMIT_HWID_PER_MIN", 30)), int(os.environ.get("RATE_LIMIT_HWID_BURST", 30)))
+metrics.register_gauge("rate_limit_buckets", lambda: ip_limiter.size() + hwid_limiter.size())
+
+# bot_config.json is re-read only when its mtime/size changes, checked at most every few seconds
+CONFIG_CHECK_INTERVAL = 3.0
+_config_lock = threading.Lock()
+_config = {"data": {}, "stamp": None, "next_check": 0.0}
 
 def load_config():
-    try:
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    # Hot path (/verify, OAuth): no file access between checks. Callers must not mutate the result.
+    now = time.monotonic()
+    if now < _config["next_check"]:
+        return _config["data"]
+    with _config_lock:
+        if now < _config["next_check"]:
+            return _config["data"]
+        try:
+            st = os.stat(CONFIG_FILE)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp != _config["stamp"]:
+            if stamp is None:
+                data = {}
+            else:
+                try:
+                    with open(CONFIG_FILE, "r") as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good config until the file is fixed
+                    print(f"[Config] Failed to load {CONFIG_FILE}: {e}")
+                    data = _config["data"]
+            _config["data"] = data # Single reference swap, readers see old or new
+            _config["stamp"] = stamp
+        _config["next_check"] = now + CONFIG_CHECK_INTERVAL
+    return _config["data"]
 
 def get_discord_oauth_config():
     cfg = load_config()
@@ -30,12 +99,17 @@ def get_discord_oauth_config():
     redirect_uri = os.environ.get("DISCORD_REDIRECT_URI") or cfg.get("discord_redirect_uri")
     return client_id, client_secret, redirect_uri
 
-def send_discord_webhook(title, description, color, fields=None):
-    config = load_config()
-    webhook_url = config.get('webhook_url')
-    if not webhook_url:
-        return
-    
+def parse_timestamp(value):
+    # SQLite hands back TIMESTAMP columns as 'YYYY-MM-DD HH:MM:SS[.ffffff]' strings
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    if '.' in value:
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+def send_discord_webhook(title, description, color, fields=None, kind="log"):
     embed = {
         "title": title,
         "description": description,
@@ -45,18 +119,216 @@ def send_discord_webhook(title, description, color, fields=None):
     }
     
     if fields:
-        embed["fields"] = fields
+        embed["fields"] = clean_fields(fields)
         
-    payload = {"embeds": [embed]}
-    
-    try:
-        requests.post(webhook_url, json=payload, timeout=2)
-    except:
-        pass # Don't block auth if logging fails
+    # Bot running in this process (main.py): hand over in memory, it posts on its gateway connection
+    if eventbus.bus.publish(eventbus.ServerEvent(kind, embed)):
+        return
+    enqueue_webhook(embed)
+
+def enqueue_webhook(embed):
+    if not load_config().get('webhook_url'):
+        return
+    # Delivered in the background (webhooks.py); never blocks auth
+    webhook_dispatcher.enqueue(embed)
+
+def outbox_path():
+    return DB_FILE + "-outbox"
+
+webhook_dispatcher = WebhookDispatcher(outbox_path(), lambda: load_config().get('webhook_url'))
+session_digest = digest.SessionDigest(lambda *args: send_discord_webhook(*args, kind="session_digest"))
+eventbus.bus.fallback = enqueue_webhook
+
+# Routes whose latency feeds the load monitor
+VERIFY_ENDPOINTS = {"verify_key", "verify_batch", "verify_lease"}
+
+# Routes that park waiting for an event; they do not count as in-flight load
+PARKED_ENDPOINTS = {"discord_auth_status"}
+
+# Admin routes that go through the admission gate (see admission.py)
+ADMIN_HEAVY_ENDPOINTS = {"list_keys", "get_stats", "delete_batch_keys", "reset_batch_keys", "bulk_mutate_keys"}
+# /generate only counts as heavy above this amount
+HEAVY_GENERATE_AMOUNT = 25
+
+def is_heavy_admin_request():
+    if request.endpoint not in ADMIN_HEAVY_ENDPOINTS and request.endpoint != "generate_key":
+        return False
+    data = request.get_json(silent=True) or {}
+    # Unauthenticated calls must not take gate slots; the route answers them with a 401
+    if not isinstance(data, dict) or data.get('admin_secret') != ADMIN_SECRET:
+        return False
+    if request.endpoint == "generate_key":
+        amount = data.get('amount', 1)
+        return isinstance(amount, int) and amount > HEAVY_GENERATE_AMOUNT
+    return True
+
+@app.before_request
+def track_request_start():
+    g.request_started = time.monotonic()
+    if is_heavy_admin_request():
+        # Gated admin work (queued or running) is bounded by the gate itself and
+        # stays out of the in-flight count that drives /verify's 503s
+        if not admin_gate.enter():
+            resp = jsonify({"error": "Server busy with admin work, retry shortly."})
+            resp.headers["Retry-After"] = "5"
+            return resp, 503
+        g.admin_admitted = True
+    elif request.endpoint not in PARKED_ENDPOINTS:
+        load_monitor.request_started()
+        g.load_tracked = True
+
+def revoke_access(c, keys=(), hwids=(), reason="revoked"):
+    # Revokes leases now (before commit) and pushes to connected clients after the request
+    leases.revoke(c, keys=keys, hwids=hwids)
+    g.setdefault("pending_push", []).append((list(keys), list(hwids), reason))
+    if keys:
+        mark_cache_dirty(shmcache.KIND_LICENSE)
+    if hwids:
+        mark_cache_dirty(shmcache.KIND_BLACKLIST)
+
+def mark_cache_dirty(kind):
+    # Shared cache generations are bumped by bump_cache_dirty() once the route has committed
+    g.setdefault("cache_dirty", set()).add(kind)
+
+def bump_cache_dirty():
+    """
+    Call right after conn.commit(), before any other work: until the bump, other
+    workers still serve the pre-write row from the shared cache (and e.g. would
+    activate an already activated key again). Teardown calls it as a fallback.
+    """
+    for kind in g.pop("cache_dirty", ()):
+        if shared_cache:
+            shared_cache.bump(kind)
+
+# Admin reads that support ETag/If-None-Match and gzip/deflate
+ADMIN_READ_ENDPOINTS = {"get_stats", "list_keys", "manage_blacklist", "search_keys", "lookup_keys"}
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_ENCODINGS = {"gzip": 31, "deflate": 15} # zlib wbits per Content-Encoding
+
+# Per-launch columns (run_count, last_seen, ip_address) do not move data_version,
+# so listings that show them are re-tagged every TELEMETRY_REFRESH seconds instead:
+# a 304 may hand back those columns up to that old
+TELEMETRY_REFRESH = 60
+
+def telemetry_window():
+    return int(time.time() // TELEMETRY_REFRESH)
+
+def get_meta_counter(name):
+    conn = sqlite3.connect(DB_FILE)
+    row = conn.execute("SELECT value FROM db_meta WHERE name=?", (name,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def not_modified(data, extra="", counter="data_version"):
+    """
+    Tags the response with a weak ETag (a db_meta change counter + request parameters).
+    Weak because it names a version of the data, not the bytes: the per-launch
+    columns can differ under the same tag (see TELEMETRY_REFRESH), and it is
+    shared by every Content-Encoding.
+    Returns a 304 response if the client already holds that version, else None.
+    Read the version before the data: a write in between only costs the client a refetch.
+    """
+    params = {k: v for k, v in data.items() if k != 'admin_secret'}
+    raw = f"{counter}:{get_meta_counter(counter)}|{json.dumps(params, sort_keys=True)}|{extra}"
+    g.etag = hashlib.sha256(raw.encode()).hexdigest()[:32]
+    if request.if_none_match.contains_weak(g.etag):
+        metrics.inc("admin_not_modified")
+        resp = Response(status=304)
+        resp.set_etag(g.etag, weak=True)
+        return resp
+    return None
+
+@app.after_request
+def compress_response(resp):
+    if request.endpoint not in ADMIN_READ_ENDPOINTS or resp.status_code != 200:
+        return resp
+    etag = g.pop("etag", None)
+    if resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers:
+        return resp
+    resp.headers.add("Vary", "Accept-Encoding")
+    encoding = None
+    if resp.content_length and resp.content_length >= COMPRESS_MIN_BYTES:
+        encoding = next((e for e in request.accept_encodings.values() if e in COMPRESS_ENCODINGS), None)
+    if encoding:
+        comp = zlib.compressobj(6, zlib.DEFLATED, COMPRESS_ENCODINGS[encoding])
+        resp.set_data(comp.compress(resp.get_data()) + comp.flush())
+        resp.headers["Content-Encoding"] = encoding
+    if etag:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+@app.teardown_request
+def track_request_end(exc):
+    # Bump even on errors: a spurious bump only costs a few cache misses
+    bump_cache_dirty()
+    # Routes commit before returning, so pushes never race the write they announce
+    for keys, hwids, reason in g.pop("pending_push", []):
+        if exc is None:
+            push_hub.publish(keys, hwids, reason)
+    if "request_started" not in g:
+        return
+    if g.pop("admin_admitted", False):
+        admin_gate.leave()
+    if g.pop("load_tracked", False):
+        load_monitor.request_finished()
+    if request.endpoint in VERIFY_ENDPOINTS:
+        elapsed = time.monotonic() - g.request_started
+        load_monitor.record_latency(elapsed)
+        metrics.observe(request.endpoint, elapsed)
+
+def check_overload():
+    # 503 + Retry-After while overloaded, so clients back off instead of piling on
+    wait = load_monitor.overload_retry_after()
+    if not wait:
+        return None
+    resp = jsonify({"valid": False, "message": "Server busy, retry later.", "next_check_in": wait})
+    resp.headers["Retry-After"] = str(wait)
+    return resp, 503
+
+def check_verify_rate_limit(hwid):
+    # Runs before any DB access. Returns a 429 response or None.
+    wait = ip_limiter.acquire(request.remote_addr)
+    if wait:
+        metrics.inc("verify_rate_limited_ip")
+    else:
+        wait = hwid_limiter.acquire(hwid)
+        if wait:
+            metrics.inc("verify_rate_limited_hwid")
+    if not wait:
+        return None
+    resp = jsonify({"valid": False, "message": "Too many requests, slow down."})
+    resp.headers["Retry-After"] = retry_after_header(wait)
+    return resp, 429
+
+# Writes that change what /verify sees bump db_meta.state_version (run_count/last_seen do not)
+STATE_TRIGGERS = [
+    ("trg_licenses_state_ins", "AFTER INSERT ON licenses"),
+    ("trg_licenses_state_del", "AFTER DELETE ON licenses"),
+    ("trg_licenses_state_upd", "AFTER UPDATE OF status, hwid, discord_id, duration_hours, expires_epoch ON licenses"),
+    ("trg_blacklist_state_ins", "AFTER INSERT ON blacklist"),
+    ("trg_blacklist_state_del", "AFTER DELETE ON blacklist"),
+]
+
+# Change counters in db_meta behind the admin read ETags:
+# data_version for licenses (not the per-launch run_count/last_seen/ip_address
+# writes, which would put a db_meta write on every /verify), blacklist_version
+# for the blacklist
+META_COUNTER_TRIGGERS = [
+    ("data_version", "trg_licenses_data_ins", "AFTER INSERT ON licenses"),
+    ("data_version", "trg_licenses_data_del", "AFTER DELETE ON licenses"),
+    ("data_version", "trg_licenses_data_upd_cols", "AFTER UPDATE OF key_code, status, hwid, device_name, note, discord_id, "
+                                                   "duration_hours, expires_at, expires_epoch, redeemed_at, created_at ON licenses"),
+    ("blacklist_version", "trg_blacklist_version_ins", "AFTER INSERT ON blacklist"),
+    ("blacklist_version", "trg_blacklist_version_del", "AFTER DELETE ON blacklist"),
+    ("blacklist_version", "trg_blacklist_version_upd", "AFTER UPDATE ON blacklist"),
+]
 
 def init_db():
+    global shared_cache, _warm_snapshot
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
+    # WAL lets long admin reads (/list, /stats) run without blocking /verify writes
+    c.execute("PRAGMA journal_mode=WAL")
     c.execute('''CREATE TABLE IF NOT EXISTS licenses
                  (key_code TEXT PRIMARY KEY, 
                   status TEXT, 
@@ -84,6 +356,25 @@ def init_db():
         c.execute("ALTER TABLE licenses ADD COLUMN ip_address TEXT")
     if 'last_seen' not in columns:
         c.execute("ALTER TABLE licenses ADD COLUMN last_seen TIMESTAMP")
+    if 'expires_epoch' not in columns:
+        # Unix-seconds copy of expires_at, so /verify and the sweeper never parse dates
+        c.execute("ALTER TABLE licenses ADD COLUMN expires_epoch INTEGER")
+        c.execute("SELECT key_code, expires_at FROM licenses WHERE expires_at IS NOT NULL")
+        for key_code, expires_at in c.fetchall():
+            try:
+                epoch = int(parse_timestamp(expires_at).timestamp())
+            except ValueError:
+                continue
+            c.execute("UPDATE licenses SET expires_epoch=? WHERE key_code=?", (epoch, key_code))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_licenses_expiry ON licenses (status, expires_epoch)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_licenses_discord ON licenses (discord_id)")
+    # Sort order for paginated listings (newest first, key_code breaks ties)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_licenses_created ON licenses (created_at, key_code)")
+    # /keys/search filters
+    c.execute("CREATE INDEX IF NOT EXISTS idx_licenses_hwid ON licenses (hwid)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_licenses_note ON licenses (note)")
+    # Trigram full-text index for /keys/lookup
+    fulltext.setup(c)
         
     # Create Blacklist Table
     c.execute('''CREATE TABLE IF NOT EXISTS blacklist
@@ -96,50 +387,187 @@ def init_db():
                  (discord_id TEXT PRIMARY KEY, 
                   balance INTEGER DEFAULT 0,
                   last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+    # Lease revocations (bans/resets/deletes), so they outlive a restart
+    leases.create_table(c)
+    leases.load_secret(DB_FILE + "-lease-secret")
+
+    # DB change counter, used to validate warm-start snapshots
+    c.execute('''CREATE TABLE IF NOT EXISTS db_meta
+                 (name TEXT PRIMARY KEY, 
+                  value INTEGER)''')
+    c.execute("INSERT OR IGNORE INTO db_meta (name, value) VALUES ('state_version', 0)")
+    for name, when in STATE_TRIGGERS:
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {when} BEGIN UPDATE db_meta SET value = value + 1 WHERE name='state_version'; END")
+    for counter, name, when in META_COUNTER_TRIGGERS:
+        c.execute("INSERT OR IGNORE INTO db_meta (name, value) VALUES (?, 0)", (counter,))
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {when} BEGIN UPDATE db_meta SET value = value + 1 WHERE name='{counter}'; END")
+    # Needs db_meta: later revocations from other processes are noticed through state_version
+    leases.load_revocations(conn, DB_FILE)
+
+    # Heartbeat aggregates flushed by presence.py
+    c.execute('''CREATE TABLE IF NOT EXISTS presence_stats
+                 (recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, 
+                  online_now INTEGER, 
+                  online_peak INTEGER, 
+                  heartbeats INTEGER)''')
         
     conn.commit()
+    state_version = warmup.get_state_version(conn)
     conn.close()
 
-@app.route('/')
-def home():
-    return "I am alive!", 200
+    # The shared cache survives restarts; keep it only if nothing changed since the last snapshot
+    # (offline-mode writes by the bot also move state_version)
+    shared_cache = shmcache.open_cache(DB_FILE)
+    _warm_snapshot = warmup.load_snapshot(warm_snapshot_path())
+    if shared_cache and not _snapshot_matches(_warm_snapshot, state_version):
+        shared_cache.bump_all()
 
-@app.route('/verify', methods=['POST'])
-def verify_key():
-    data = request.json
-    key = data.get('key')
-    hwid = data.get('hwid')
-    device_name = data.get('device_name')
+    if sessions.LINK_SESSION_PERSIST:
+        link_sessions.enable_persistence(DB_FILE)
 
-    if not key or not hwid:
-        return jsonify({"valid": False, "message": "Missing key or HWID"}), 400
+def warm_snapshot_path():
+    return DB_FILE + "-warm"
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+def _snapshot_matches(snapshot, state_version):
+    if not snapshot or snapshot.get("state_version") != state_version:
+        return False
+    gens = [shared_cache.generation(shmcache.KIND_LICENSE), shared_cache.generation(shmcache.KIND_BLACKLIST)]
+    return snapshot.get("cache_gens") == gens
 
-    # Check Blacklist
-    c.execute("SELECT * FROM blacklist WHERE hwid=?", (hwid,))
-    if c.fetchone():
+def warm_up():
+    # Page cache first, then the shared cache and counters from the snapshot
+    started = time.monotonic()
+    snapshot = _warm_snapshot or {}
+    try:
+        read = warmup.prewarm_file(DB_FILE)
+        warmup.prewarm_queries(DB_FILE)
+        metrics.restore(snapshot.get("counters", {}))
+        conn = sqlite3.connect(DB_FILE)
+        c = conn.cursor()
+        for key in snapshot.get("hot_keys", []):
+            load_license(c, key) # Fills the shared cache (a no-op hit if it is still valid)
+        if shared_cache:
+            gen = shared_cache.generation(shmcache.KIND_BLACKLIST)
+            c.execute("SELECT hwid FROM blacklist")
+            for (hwid,) in c.fetchall():
+                shared_cache.put_blacklisted(gen, hwid, True)
         conn.close()
-        return jsonify({"valid": False, "message": "HWID Blacklisted"}), 403
+        print(f"[Warmup] Prewarmed {read // 1024} KiB, {len(snapshot.get('hot_keys', []))} hot keys in {time.monotonic() - started:.2f}s")
+    except Exception as e:
+        print(f"[Warmup] Warm-up incomplete: {e}")
+    finally:
+        server_ready.set()
+
+def save_warm_snapshot():
+    conn = sqlite3.connect(DB_FILE)
+    state_version = warmup.get_state_version(conn)
+    conn.close()
+    gens = None
+    if shared_cache:
+        gens = [shared_cache.generation(shmcache.KIND_LICENSE), shared_cache.generation(shmcache.KIND_BLACKLIST)]
+    warmup.save_snapshot(warm_snapshot_path(), {
+        "state_version": state_version,
+        "cache_gens": gens,
+        "hot_keys": warmup.hot_keys(),
+        "counters": metrics.snapshot()["counters"],
+    })
+
+def _snapshot_loop():
+    while True:
+        time.sleep(warmup.SNAPSHOT_INTERVAL)
+        try:
+            save_warm_snapshot()
+        except Exception as e:
+            print(f"[Warmup] Snapshot failed: {e}")
+
+def on_keys_expired(expired):
+    if shared_cache:
+        shared_cache.bump(shmcache.KIND_LICENSE)
+    # One embed per sweep, not per key
+    lines = [f"`{key_code}` " + (f"<@{discord_id}>" if discord_id else "Unknown User") for key_code, discord_id in expired]
+    value = "\n".join(lines)
+    if len(value) > 1024:
+        value = value[:1000] + "\n…"
+    fields = [{"name": "🔑 Keys", "value": value, "inline": False}]
+    send_discord_webhook("⏰ Keys Expired", f"{len(expired)} key(s) reached their expiry time.", 16753920, fields, kind="keys_expired") # Orange
+
+expiry_sweeper = ExpirySweeper(DB_FILE, on_keys_expired)
+metrics.register_gauge("expiry_heap_size", expiry_sweeper.size)
 
-    c.execute("SELECT status, hwid, duration_hours, expires_at FROM licenses WHERE key_code=?", (key,))
+def start_background_workers():
+    # Called once after init_db() by whoever runs the app (main.py / __main__)
+    expiry_sweeper.db_file = DB_FILE
+    expiry_sweeper.start()
+    presence.start_flusher(DB_FILE)
+    webhook_dispatcher.outbox_file = outbox_path()
+    webhook_dispatcher.start()
+    atexit.register(webhook_dispatcher.drain_to_outbox) # Runs after the digest flush below
+    if digest.DIGEST_INTERVAL > 0:
+        session_digest.start()
+        atexit.register(session_digest.flush)
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    threading.Thread(target=_snapshot_loop, name="warm-snapshot", daemon=True).start()
+    atexit.register(save_warm_snapshot)
+
+@app.route('/')
+def home():
+    return "I am alive!", 200
+
+@app.route('/ready')
+def ready():
+    # 503 until warm-up has finished, for health checks that gate traffic
+    if not server_ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True})
+
+def load_license(c, key, fresh=False):
+    """(status, hwid, duration_hours, discord_id, expires_epoch) for `key`, from the shared cache or (fresh=True: always) the DB."""
+    warmup.touch(key)
+    gen = None
+    if shared_cache and not fresh:
+        hit = shared_cache.get_license(key)
+        if hit:
+            metrics.inc("verify_cache_hit")
+            return hit
+        # Read the generation before the DB so a concurrent write makes our fill a no-op
+        gen = shared_cache.generation(shmcache.KIND_LICENSE)
+    c.execute("SELECT status, hwid, duration_hours, discord_id, expires_epoch FROM licenses WHERE key_code=?", (key,))
     row = c.fetchone()
+    if gen is not None and row:
+        metrics.inc("verify_cache_miss")
+        shared_cache.put_license(gen, key, *row)
+    return row
 
-    if not row:
-        conn.close()
-        return jsonify({"valid": False, "message": "Invalid Key"}), 403
+def is_hwid_blacklisted(c, hwid):
+    gen = None
+    if shared_cache:
+        hit = shared_cache.get_blacklisted(hwid)
+        if hit is not None:
+            return hit
+        gen = shared_cache.generation(shmcache.KIND_BLACKLIST)
+    c.execute("SELECT 1 FROM blacklist WHERE hwid=?", (hwid,))
+    blacklisted = c.fetchone() is not None
+    if shared_cache:
+        shared_cache.put_blacklisted(gen, hwid, blacklisted)
+    return blacklisted
 
-    status, stored_hwid, duration, expires_at = row
+def _verify_license(c, key, hwid, device_name, client_ip, fresh=False):
+    """
+    Evaluates one key against the licenses table using cursor `c`.
+    Does not commit. Returns (response_dict, http_status, webhook_event)
+    where webhook_event is (kind, fields) or None.
+    """
+    row = load_license(c, key, fresh)
 
-    # Retrieve Discord User Info if available
-    c.execute("SELECT discord_id FROM licenses WHERE key_code=?", (key,))
-    discord_id = c.fetchone()[0]
+    if not row:
+        return {"valid": False, "message": "Invalid Key"}, 403, None
+
+    status, stored_hwid, duration, discord_id, expires_epoch = row
     
     # [STRICT] Enforce Key Claiming
     if not discord_id:
-        conn.close()
-        return jsonify({"valid": False, "message": "Key must be claimed first!"}), 403
+        return {"valid": False, "message": "Key must be claimed first!"}, 403, None
     
     # Count user's total active keys
     total_keys = 0
@@ -147,75 +575,330 @@ def verify_key():
         c.execute("SELECT COUNT(*) FROM licenses WHERE discord_id=?", (discord_id,))
         total_keys = c.fetchone()[0]
 
-    # Check expiration if active
-    # if expires_at:
-    #     expiry_dt = datetime.datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S.%f') if '.' in expires_at else datetime.datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S')
-    #     if datetime.datetime.now() > expiry_dt:
-    #         conn.close()
-    #         return jsonify({"valid": False, "message": "Key Expired"}), 403
+    # Check expiration if active (the sweeper flips status too, but may lag a moment)
+    if status == "expired" or (status == "used" and expires_epoch and time.time() >= expires_epoch):
+        return {"valid": False, "message": "Key Expired"}, 403, None
+
+    user_str = f"<@{discord_id}>" if discord_id else "Unknown User"
 
     if status == "unused":
         # First activation
         new_expires_at = None
+        new_expires_epoch = None
         if duration and duration > 0:
             new_expires_at = datetime.datetime.now() + datetime.timedelta(hours=duration)
+            new_expires_epoch = int(new_expires_at.timestamp())
         
         redeemed_time = datetime.datetime.now()
-        client_ip = request.remote_addr
-        c.execute("UPDATE licenses SET status='used', hwid=?, device_name=?, expires_at=?, redeemed_at=?, last_seen=?, ip_address=? WHERE key_code=?", 
-                  (hwid, device_name, new_expires_at, redeemed_time, redeemed_time, client_ip, key))
-        conn.commit()
-        conn.close()
+        c.execute("UPDATE licenses SET status='used', hwid=?, device_name=?, expires_at=?, expires_epoch=?, redeemed_at=?, last_seen=?, ip_address=? WHERE key_code=? AND status='unused'", 
+                  (hwid, device_name, new_expires_at, new_expires_epoch, redeemed_time, redeemed_time, client_ip, key))
+        if c.rowcount == 0:
+            # Lost a race with a concurrent activation: judge against the row that won
+            return _verify_license(c, key, hwid, device_name, client_ip, fresh=True)
+        expiry_sweeper.schedule(key, new_expires_epoch)
+        mark_cache_dirty(shmcache.KIND_LICENSE)
         
-        # LOG ACTIVATION
-        user_str = f"<@{discord_id}>" if discord_id else "Unknown User"
         fields = [
             {"name": "👤 User", "value": user_str, "inline": True},
             {"name": "🔑 Key", "value": f"`{key}`", "inline": True},
             {"name": "💻 Device", "value": f"{device_name}", "inline": True},
             {"name": "🔢 Total Accounts", "value": f"{total_keys}", "inline": True}
         ]
-        send_discord_webhook("🟢 New Activation", f"Key activated by {user_str}", 65280, fields) # Green
-        
-        return jsonify({"valid": True, "message": "Key Activated Successfully!", "discord_id": discord_id})
+        result = {"valid": True, "message": "Key Activated Successfully!", "discord_id": discord_id}
+        _attach_lease(result, key, hwid, discord_id, new_expires_epoch)
+        return result, 200, ("activation", fields)
 
     elif status == "used":
         if stored_hwid == hwid:
             # Increment run count and update last seen
-            client_ip = request.remote_addr
             last_seen = datetime.datetime.now()
             c.execute("UPDATE licenses SET run_count = run_count + 1, last_seen=?, ip_address=? WHERE key_code=?", (last_seen, client_ip, key))
-            conn.commit()
-            conn.close()
             
-            # LOG USAGE (SESSION START)
-            user_str = f"<@{discord_id}>" if discord_id else "Unknown User"
             fields = [
                 {"name": "👤 User", "value": user_str, "inline": True},
                 {"name": "🔑 Key", "value": f"`{key}`", "inline": True},
                 {"name": "💻 Device", "value": f"{device_name}", "inline": True},
                 {"name": "🔢 Total Accounts", "value": f"{total_keys}", "inline": True}
             ]
-            send_discord_webhook("🔵 Session Started", f"User {user_str} launched the software.", 3447003, fields) # Blue
-        
-            return jsonify({"valid": True, "message": "Welcome back!", "discord_id": discord_id})
+            result = {"valid": True, "message": "Welcome back!", "discord_id": discord_id}
+            _attach_lease(result, key, hwid, discord_id, expires_epoch)
+            return result, 200, ("session", fields)
         else:
-            conn.close()
-            
-            # LOG FAILED ATTEMPT (HWID Mismatch)
-            user_str = f"<@{discord_id}>" if discord_id else "Unknown User"
             fields = [
                 {"name": "👤 User", "value": user_str, "inline": True},
                 {"name": "🔑 Key", "value": f"`{key}`", "inline": True},
                 {"name": "💻 Expected HWID", "value": f"`{stored_hwid}`", "inline": True},
                 {"name": "⚠️ Attempted HWID", "value": f"`{hwid}`", "inline": True}
             ]
-            send_discord_webhook("⚠️ Suspicious Login Attempt", f"HWID Mismatch for {user_str}", 16711680, fields) # Red
+            event = _check_sharing(c, key, discord_id, hwid, client_ip, ("mismatch", fields))
+            return {"valid": False, "message": "Key already used on another device!"}, 403, event
+
+    elif status == "banned":
+        return {"valid": False, "message": "Key Banned"}, 403, None
+
+    return {"valid": False, "message": "Unknown Error"}, 500, None
+
+def _check_sharing(c, key, discord_id, hwid, client_ip, mismatch_event):
+    """
+    Feeds an HWID mismatch to the sharing detector (per key and per owner).
+    Returns the webhook event to send: the plain mismatch, a one-off sharing
+    alert if a threshold was just crossed, or None once it has been handled.
+    """
+    worst = None
+    handled = False
+    for subject in (f"key:{key}", f"user:{discord_id}"):
+        decision, stats = sharing.detector.record(subject, hwid, client_ip)
+        if decision == "handled":
+            handled = True
+        elif decision and (worst is None or decision == "ban"):
+            worst = (decision, subject, stats)
+
+    if not worst:
+        return None if handled else mismatch_event
+
+    decision, subject, stats = worst
+    if subject.startswith("user:"):
+        c.execute("SELECT key_code FROM licenses WHERE discord_id=?", (discord_id,))
+        keys = [r[0] for r in c.fetchall()]
+    else:
+        keys = [key]
+    reason = f"Auto: key sharing ({stats['attempts']} mismatches, {stats['hwids']} HWIDs, {stats['ips']} IPs)"
+    if decision == "ban":
+        ban_keys(c, keys, reason)
+    else:
+        flag_keys(c, keys, reason)
+
+    fields = [
+        mismatch_event[1][0],
+        {"name": "🔑 Keys", "value": ", ".join(f"`{k}`" for k in keys)[:1024], "inline": True},
+        {"name": "🛡️ Action", "value": "Banned" if decision == "ban" else "Flagged", "inline": True},
+        {"name": "⚠️ Mismatches", "value": f"{stats['attempts']}", "inline": True},
+        {"name": "💻 Distinct HWIDs", "value": f"{stats['hwids']}", "inline": True},
+        {"name": "🌐 Distinct IPs", "value": f"{stats['ips']}", "inline": True}
+    ]
+    return ("sharing", fields)
+
+def _attach_lease(result, key, hwid, discord_id, expires_epoch):
+    token, lease_expires = leases.issue_lease(key, hwid, discord_id, expires_epoch)
+    if token:
+        result["lease"] = token
+        result["lease_expires_at"] = lease_expires
+
+# Webhook title/description/color per verify event kind
+VERIFY_EVENT_STYLES = {
+    "activation": ("🟢 New Activation", "Key activated by {user}", 65280), # Green
+    "session": ("🔵 Session Started", "User {user} launched the software.", 3447003), # Blue
+    "mismatch": ("⚠️ Suspicious Login Attempt", "HWID Mismatch for {user}", 16711680), # Red
+    "sharing": ("🚨 Key Sharing Detected", "Possible key sharing by {user}", 10038562), # Dark Red
+}
+
+def send_verify_webhook(event):
+    kind, fields = event
+    if kind == "session" and digest.DIGEST_INTERVAL > 0:
+        # user, key, device fields; posted later as one summary embed
+        session_digest.add(fields[0]["value"], fields[1]["value"], fields[2]["value"])
+        return
+    title, description, color = VERIFY_EVENT_STYLES[kind]
+    send_discord_webhook(title, description.format(user=fields[0]["value"]), color, fields, kind=kind)
+
+@app.route('/verify', methods=['POST'])
+def verify_key():
+    data = request.json
+    key = data.get('key')
+    hwid = data.get('hwid')
+    device_name = data.get('device_name')
+
+    if not key or not hwid:
+        return jsonify({"valid": False, "message": "Missing key or HWID"}), 400
+    if not isinstance(key, str) or not isinstance(hwid, str):
+        return jsonify({"valid": False, "message": "Key and HWID must be strings"}), 400
+
+    limited = check_overload() or check_verify_rate_limit(hwid)
+    if limited:
+        return limited
+
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+
+    # Check Blacklist
+    if is_hwid_blacklisted(c, hwid):
+        conn.close()
+        return jsonify({"valid": False, "message": "HWID Blacklisted"}), 403
+
+    result, code, event = _verify_license(c, key, hwid, device_name, request.remote_addr)
+    conn.commit()
+    bump_cache_dirty()
+    conn.close()
+
+    if event:
+        send_verify_webhook(event)
+
+    if result.get("valid"):
+        result["next_check_in"] = load_monitor.next_check_in()
+    return jsonify(result), code
+
+@app.route('/verify_lease', methods=['POST'])
+def verify_lease():
+    # Lightweight re-verification: signature + revocation set only, no DB access
+    data = request.json
+    token = data.get('lease')
+    hwid = data.get('hwid')
+
+    if not token or not hwid:
+        return jsonify({"valid": False, "message": "Missing lease or HWID"}), 400
 
-            return jsonify({"valid": False, "message": "Key already used on another device!"}), 403
+    lease, reason = leases.check_lease(token, hwid)
+    if not lease:
+        # Client should fall back to a full /verify
+        return jsonify({"valid": False, "message": reason}), 403
+
+    return jsonify({"valid": True, "message": "Welcome back!", "discord_id": lease["discord_id"], "lease_expires_at": lease["expires_at"],
+                    "next_check_in": load_monitor.next_check_in()})
+
+@app.route('/heartbeat', methods=['POST'])
+def heartbeat():
+    # Presence ping: authenticated by the lease from /verify, memory only
+    data = request.json
+    token = data.get('lease')
+    hwid = data.get('hwid')
+
+    if not token or not hwid:
+        return jsonify({"ok": False, "message": "Missing lease or HWID"}), 400
+
+    lease, reason = leases.check_lease(token, hwid)
+    if not lease:
+        return jsonify({"ok": False, "message": reason}), 403
+
+    presence.tracker.beat(lease["key"], hwid)
+    return jsonify({"ok": True, "next_heartbeat_in": presence.HEARTBEAT_INTERVAL})
+
+@app.route('/events')
+def revocation_events():
+    # SSE stream telling a running client to re-verify when its key is revoked
+    token = request.args.get('lease', '')
+    hwid = request.args.get('hwid', '')
+    lease, reason = leases.check_lease(token, hwid)
+    if not lease:
+        return jsonify({"ok": False, "message": reason}), 403
+
+    q = push_hub.subscribe(lease["key"], hwid)
+    if q is None:
+        resp = jsonify({"ok": False, "message": "Too many connections"})
+        resp.headers["Retry-After"] = "60"
+        return resp, 503
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(push_hub.stream(q, lease["expires_at"]), mimetype="text/event-stream", headers=headers)
+
+@app.route('/presence', methods=['POST'])
+def get_presence():
+    data = request.json
+    if data.get('admin_secret') != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    key = data.get('key')
+    if key:
+        return jsonify({"key": key, "online": presence.tracker.online_for(key)})
+    online_keys = presence.tracker.online_keys()
+    return jsonify({"online_now": sum(online_keys.values()), "keys": online_keys})
+
+# Max keys accepted by a single /verify_batch call
+MAX_BATCH_KEYS = 50
+
+@app.route('/verify_batch', methods=['POST'])
+def verify_batch():
+    data = request.json
+    keys = data.get('keys', [])
+    hwid = data.get('hwid')
+    device_name = data.get('device_name')
+
+    if not keys or not hwid or not isinstance(keys, list):
+        return jsonify({"valid": False, "message": "Missing keys or HWID"}), 400
+    if len(keys) > MAX_BATCH_KEYS:
+        return jsonify({"valid": False, "message": f"Too many keys (max {MAX_BATCH_KEYS})"}), 400
+    if not all(isinstance(k, str) and k for k in keys):
+        return jsonify({"valid": False, "message": "Keys must be non-empty strings"}), 400
+    if not isinstance(hwid, str):
+        return jsonify({"valid": False, "message": "HWID must be a string"}), 400
+
+    limited = check_overload() or check_verify_rate_limit(hwid)
+    if limited:
+        return limited
+
+    # Same key twice in one batch is evaluated once
+    keys = list(dict.fromkeys(keys))
+
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+
+    # Check Blacklist once for the whole batch
+    if is_hwid_blacklisted(c, hwid):
+        conn.close()
+        results = [{"key": k, "valid": False, "message": "HWID Blacklisted", "status_code": 403} for k in keys]
+        return jsonify({"hwid": hwid, "results": results})
+
+    client_ip = request.remote_addr
+    results = []
+    events = []
+    try:
+        for key in keys:
+            result, code, event = _verify_license(c, key, hwid, device_name, client_ip)
+            results.append(dict(result, key=key, status_code=code))
+            if event:
+                events.append(event)
+        conn.commit()
+        bump_cache_dirty()
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 500
 
     conn.close()
-    return jsonify({"valid": False, "message": "Unknown Error"}), 500
+
+    if digest.DIGEST_INTERVAL > 0:
+        for event in events:
+            if event[0] == "session":
+                send_verify_webhook(event)
+        events = [e for e in events if e[0] != "session"]
+    if events:
+        send_verify_batch_webhook(events, hwid, device_name)
+
+    return jsonify({"hwid": hwid, "results": results, "next_check_in": load_monitor.next_check_in()})
+
+def send_verify_batch_webhook(events, hwid, device_name):
+    # One embed for the whole batch instead of one per key
+    counts = {"activation": 0, "session": 0, "mismatch": 0, "sharing": 0}
+    users = []
+    key_lines = []
+    for kind, fields in events:
+        counts[kind] += 1
+        if fields[0]["value"] not in users:
+            users.append(fields[0]["value"])
+        key_lines.append(f"{VERIFY_EVENT_STYLES[kind][0].split(' ')[0]} {fields[1]['value']}")
+
+    if counts["sharing"]:
+        color = VERIFY_EVENT_STYLES["sharing"][2]
+    elif counts["mismatch"]:
+        color = VERIFY_EVENT_STYLES["mismatch"][2]
+    elif counts["activation"]:
+        color = VERIFY_EVENT_STYLES["activation"][2]
+    else:
+        color = VERIFY_EVENT_STYLES["session"][2]
+
+    keys_value = "\n".join(key_lines)
+    if len(keys_value) > 1024:
+        keys_value = keys_value[:1000] + "\n…"
+
+    fields = [
+        {"name": "👤 User", "value": ", ".join(users), "inline": True},
+        {"name": "💻 Device", "value": f"{device_name}", "inline": True},
+        {"name": "🖥️ HWID", "value": f"`{hwid}`", "inline": True},
+        {"name": "🟢 Activations", "value": f"{counts['activation']}", "inline": True},
+        {"name": "🔵 Sessions", "value": f"{counts['session']}", "inline": True},
+        {"name": "⚠️ Mismatches", "value": f"{counts['mismatch']}", "inline": True},
+        {"name": "🚨 Sharing Alerts", "value": f"{counts['sharing']}", "inline": True},
+        {"name": "🔑 Keys", "value": keys_value, "inline": False}
+    ]
+    send_discord_webhook("📦 Batch Verify", f"{len(events)} instance(s) verified for {', '.join(users)}", color, fields, kind="batch_verify")
 
 @app.route('/generate', methods=['POST'])
 def generate_key():
@@ -318,11 +1001,61 @@ def link_discord():
     # Link the key
     print(f"DEBUG: Linking key {key} to {discord_id}")
     c.execute("UPDATE licenses SET discord_id=? WHERE key_code=?", (discord_id, key))
+    mark_cache_dirty(shmcache.KIND_LICENSE)
     conn.commit()
+    bump_cache_dirty()
     conn.close()
     
     return jsonify({"success": True, "message": "Discord Account Linked"})
 
+# Key listings are paginated by keyset: pass `limit` and the `next` cursor of the
+# previous page as `after`. The cursor is "<created_at>,<key_code>" of the last row.
+# `"all": true` returns every row in one response (the old behaviour).
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 500
+
+def parse_limit(data):
+    """Returns (limit, error), capped at PAGE_SIZE_MAX."""
+    limit = data.get('limit', PAGE_SIZE_DEFAULT)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return None, "limit must be a positive integer"
+    return min(limit, PAGE_SIZE_MAX), None
+
+def parse_page_args(data):
+    """Returns (after, limit, error). `after` is a (created_at, key_code) tuple or None."""
+    limit, error = parse_limit(data)
+    if error:
+        return None, None, error
+    after = data.get('after')
+    if after:
+        created_at, sep, key_code = str(after).rpartition(",")
+        if not sep or not created_at or not key_code:
+            return None, None, "Invalid cursor"
+        after = (created_at, key_code)
+    return after, limit, None
+
+def listing_response(data, name, items, **extra):
+    # Bulk listings can be asked for column-major ("encoding": "columns", see columnar.py)
+    if data.get('encoding') == 'columns':
+        return Response(columnar.dumps(dict(columnar.to_columns(items), **extra)), mimetype="application/json")
+    return jsonify({name: items, **extra})
+
+def fetch_key_page(c, where, params, after, limit):
+    """Runs a newest-first page query. Returns (rows, next_cursor)."""
+    if after:
+        where = f"{where} AND (created_at, key_code) < (?, ?)" if where else "(created_at, key_code) < (?, ?)"
+        params = tuple(params) + after
+    sql = "SELECT * FROM licenses"
+    if where:
+        sql += f" WHERE {where}"
+    # One extra row tells us whether there is a next page
+    c.execute(sql + " ORDER BY created_at DESC, key_code DESC LIMIT ?", tuple(params) + (limit + 1,))
+    rows = c.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, f"{rows[-1]['created_at']},{rows[-1]['key_code']}"
+
 @app.route('/get_user_keys', methods=['POST'])
 def get_user_keys():
     data = request.json
@@ -332,12 +1065,19 @@ def get_user_keys():
     discord_id = data.get('discord_id')
     if not discord_id:
         return jsonify({"error": "Missing discord_id"}), 400
+
+    after, limit, error = parse_page_args(data)
+    if error:
+        return jsonify({"error": error}), 400
         
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT * FROM licenses WHERE discord_id=?", (discord_id,))
-    rows = c.fetchall()
+    if data.get('all'):
+        c.execute("SELECT * FROM licenses WHERE discord_id=?", (discord_id,))
+        rows, next_cursor = c.fetchall(), None
+    else:
+        rows, next_cursor = fetch_key_page(c, "discord_id=?", (discord_id,), after, limit)
     
     keys = []
     for row in rows:
@@ -351,11 +1091,12 @@ def get_user_keys():
                 is_banned = True
         
         k['is_banned'] = is_banned
+        k['online'] = presence.tracker.online_for(k['key_code'])
         keys.append(k)
         
     conn.close()
     
-    return jsonify({"keys": keys})
+    return listing_response(data, "keys", keys, next=next_cursor)
 
 @app.route('/auth/discord/start')
 def discord_auth_start():
@@ -398,7 +1139,10 @@ def discord_auth_callback():
     headers = {
         "Content-Type": "application/x-www-form-urlencoded"
     }
-    token_resp = requests.post(f"{DISCORD_API_BASE}/oauth2/token", data=data, headers=headers)
+    try:
+        token_resp = outbound.client.post(f"{DISCORD_API_BASE}/oauth2/token", "discord_token", data=data, headers=headers)
+    except requests.RequestException:
+        return "Discord did not respond, please try again", 502
     if token_resp.status_code != 200:
         return "Failed to fetch token", 400
     token_json = token_resp.json()
@@ -408,7 +1152,10 @@ def discord_auth_callback():
     user_headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    user_resp = requests.get(f"{DISCORD_API_BASE}/users/@me", headers=user_headers)
+    try:
+        user_resp = outbound.client.get(f"{DISCORD_API_BASE}/users/@me", "discord_user", headers=user_headers)
+    except requests.RequestException:
+        return "Discord did not respond, please try again", 502
     if user_resp.status_code != 200:
         return "Failed to fetch user", 400
     user_info = user_resp.json()
@@ -444,7 +1191,7 @@ def discord_auth_callback():
         except Exception:
             session_id = ""
     if session_id:
-        link_sessions[session_id] = {"data": result}
+        link_sessions.put(session_id, result)
     return "<html><body><h2>Discord linked</h2><p>You can close this tab and return to Pillow Rejoin.</p></body></html>"
 
 @app.route('/auth/discord/status')
@@ -452,10 +1199,25 @@ def discord_auth_status():
     session_id = request.args.get("session_id", "")
     if not session_id:
         return jsonify({"done": False}), 400
-    entry = link_sessions.get(session_id)
-    if not entry:
+
+    if request.args.get("stream") == "1":
+        # SSE: one `done` event as soon as the callback stores the result
+        event = link_sessions.subscribe(session_id)
+        if event is None:
+            resp = jsonify({"done": False, "message": "Too many waiters"})
+            resp.headers["Retry-After"] = "5"
+            return resp, 503
+        until = time.time() + sessions.LINK_STREAM_SECONDS
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return Response(link_sessions.stream(session_id, event, until), mimetype="text/event-stream", headers=headers)
+
+    # ?wait=N long-polls up to N seconds; without it this is a plain poll.
+    # One-time read: the result is dropped once handed to the client
+    wait = min(max(request.args.get("wait", 0, type=float), 0), sessions.LINK_WAIT_SECONDS)
+    data = link_sessions.consume_wait(session_id, wait)
+    if data is None:
         return jsonify({"done": False})
-    return jsonify({"done": True, "data": entry.get("data")})
+    return jsonify({"done": True, "data": data})
 
 @app.route('/stats', methods=['POST'])
 def get_stats():
@@ -463,6 +1225,11 @@ def get_stats():
     if data.get('admin_secret') != ADMIN_SECRET:
         return jsonify({"error": "Unauthorized"}), 401
 
+    # Stats also depend on presence and on the clock (24h window), so those go into the ETag
+    cached = not_modified(data, f"{presence.tracker.online_total()}|{int(time.time() // 60)}")
+    if cached:
+        return cached
+
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
@@ -497,11 +1264,11 @@ def get_stats():
         r_created_at = row['created_at']
         
         # Status Counts
-        if r_status == 'used':
+        if r_status in ('used', 'expired'):
             used += 1
             # Check Active vs Expired
-            is_active_key = True
-            if r_expires_at:
+            is_active_key = r_status == 'used'
+            if is_active_key and r_expires_at:
                 try:
                     # Handle potential fractional seconds
                     if '.' in r_expires_at:
@@ -537,7 +1304,7 @@ def get_stats():
             pass
 
     # Get Recently Redeemed (Last 5)
-    c.execute("SELECT key_code, device_name, redeemed_at FROM licenses WHERE status='used' AND redeemed_at IS NOT NULL ORDER BY redeemed_at DESC LIMIT 5")
+    c.execute("SELECT key_code, device_name, redeemed_at FROM licenses WHERE status IN ('used', 'expired') AND redeemed_at IS NOT NULL ORDER BY redeemed_at DESC LIMIT 5")
     recently_redeemed = [dict(row) for row in c.fetchall()]
 
     conn.close()
@@ -551,6 +1318,7 @@ def get_stats():
         "lifetime": lifetime,
         "limited": limited,
         "created_24h": created_24h,
+        "online_now": presence.tracker.online_total(),
         "recent_keys": recent_keys,
         "recently_redeemed": recently_redeemed
     })
@@ -565,7 +1333,9 @@ def reset_key():
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     c.execute("UPDATE licenses SET status='unused', hwid=NULL, device_name=NULL WHERE key_code=?", (key,))
+    revoke_access(c, keys=[key], reason="reset")
     conn.commit()
+    bump_cache_dirty()
     conn.close()
     return jsonify({"message": f"Key {key} reset successfully"})
 
@@ -584,7 +1354,9 @@ def delete_key():
         conn.close()
         return jsonify({"error": "Key not found"}), 404
         
+    revoke_access(c, keys=[key], reason="deleted")
     conn.commit()
+    bump_cache_dirty()
     conn.close()
     return jsonify({"message": f"Key {key} deleted successfully"})
 
@@ -602,11 +1374,9 @@ def delete_batch_keys():
     c = conn.cursor()
     
     try:
-        # Use placeholders for secure list handling
-        placeholders = ','.join('?' for _ in keys)
-        c.execute(f"DELETE FROM licenses WHERE key_code IN ({placeholders})", keys)
-        deleted_count = c.rowcount
+        deleted_count = delete_keys(c, keys)
         conn.commit()
+        bump_cache_dirty()
     except Exception as e:
         conn.close()
         return jsonify({"error": str(e)}), 500
@@ -614,6 +1384,46 @@ def delete_batch_keys():
     conn.close()
     return jsonify({"message": f"Successfully deleted {deleted_count} keys."})
 
+def ban_keys(c, keys, reason):
+    # Shared by /ban_key and the automatic sharing detector. Caller commits.
+    placeholders = ','.join('?' for _ in keys)
+    c.execute(f"UPDATE licenses SET status='banned', note=COALESCE(note, '') || ' [BANNED: ' || ? || ']' WHERE key_code IN ({placeholders})", [reason] + keys)
+    count = c.rowcount
+    revoke_access(c, keys=keys, reason="banned")
+    return count
+
+def reset_keys(c, keys):
+    # Shared by /reset_batch and /keys/bulk. Caller commits.
+    placeholders = ','.join('?' for _ in keys)
+    c.execute(f"UPDATE licenses SET status='unused', hwid=NULL, device_name=NULL WHERE key_code IN ({placeholders})", keys)
+    count = c.rowcount
+    revoke_access(c, keys=keys, reason="reset")
+    return count
+
+def recover_keys(c, keys):
+    # Shared by /recover_key and /keys/bulk. Caller commits.
+    placeholders = ','.join('?' for _ in keys)
+    # Restore status based on HWID presence
+    c.execute(f"UPDATE licenses SET status = CASE WHEN hwid IS NOT NULL THEN 'used' ELSE 'unused' END, note = note || ' [RECOVERED]' WHERE key_code IN ({placeholders})", keys)
+    mark_cache_dirty(shmcache.KIND_LICENSE)
+    return c.rowcount
+
+def delete_keys(c, keys):
+    # Shared by /delete_batch and /keys/bulk. Caller commits.
+    placeholders = ','.join('?' for _ in keys)
+    c.execute(f"DELETE FROM licenses WHERE key_code IN ({placeholders})", keys)
+    count = c.rowcount
+    revoke_access(c, keys=keys, reason="deleted")
+    return count
+
+def flag_keys(c, keys, reason):
+    # Marks keys for admin review without blocking them; a key that is already
+    # flagged keeps its first mark, so repeat windows do not grow the note
+    placeholders = ','.join('?' for _ in keys)
+    c.execute(f"""UPDATE licenses SET note=COALESCE(note, '') || ' [FLAGGED: ' || ? || ']'
+                  WHERE key_code IN ({placeholders}) AND instr(COALESCE(note, ''), ' [FLAGGED: ') = 0""", [reason] + keys)
+    return c.rowcount
+
 @app.route('/ban_key', methods=['POST'])
 def ban_key():
     data = request.json
@@ -630,10 +1440,9 @@ def ban_key():
     c = conn.cursor()
     
     try:
-        placeholders = ','.join('?' for _ in keys)
-        c.execute(f"UPDATE licenses SET status='banned', note=note || ' [BANNED: ' || ? || ']' WHERE key_code IN ({placeholders})", [reason] + keys)
-        count = c.rowcount
+        count = ban_keys(c, keys, reason)
         conn.commit()
+        bump_cache_dirty()
     except Exception as e:
         conn.close()
         return jsonify({"error": str(e)}), 500
@@ -655,11 +1464,9 @@ def recover_key():
     c = conn.cursor()
     
     try:
-        placeholders = ','.join('?' for _ in keys)
-        # Restore status based on HWID presence
-        c.execute(f"UPDATE licenses SET status = CASE WHEN hwid IS NOT NULL THEN 'used' ELSE 'unused' END, note = note || ' [RECOVERED]' WHERE key_code IN ({placeholders})", keys)
-        count = c.rowcount
+        count = recover_keys(c, keys)
         conn.commit()
+        bump_cache_dirty()
     except Exception as e:
         conn.close()
         return jsonify({"error": str(e)}), 500
@@ -681,10 +1488,9 @@ def reset_batch_keys():
     c = conn.cursor()
     
     try:
-        placeholders = ','.join('?' for _ in keys)
-        c.execute(f"UPDATE licenses SET status='unused', hwid=NULL, device_name=NULL WHERE key_code IN ({placeholders})", keys)
-        reset_count = c.rowcount
+        reset_count = reset_keys(c, keys)
         conn.commit()
+        bump_cache_dirty()
     except Exception as e:
         conn.close()
         return jsonify({"error": str(e)}), 500
@@ -692,6 +1498,100 @@ def reset_batch_keys():
     conn.close()
     return jsonify({"message": f"Successfully reset {reset_count} keys."})
 
+# Mutate-by-filter: the filter is a keyfilter.py dict, the action one of these.
+# Key actions run the same helpers as their single-purpose routes on the selected keys
+BULK_KEY_ACTIONS = ("reset", "ban", "recover", "delete")
+# "{where}" is the filter's WHERE clause; extra parameters go before the filter's.
+BULK_ACTIONS = {
+    "set_note": "UPDATE licenses SET note=? WHERE {where}",
+    # Lifetime keys are left alone; an expired key whose new expiry is in the future is live again
+    "extend": """UPDATE licenses SET duration_hours = duration_hours + ?,
+                 status = CASE WHEN status='expired' AND expires_epoch + ? > ? THEN 'used' ELSE status END,
+                 expires_at = CASE WHEN expires_epoch IS NOT NULL THEN datetime(expires_epoch + ?, 'unixepoch', 'localtime') END,
+                 expires_epoch = expires_epoch + ?
+                 WHERE {where}""",
+}
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", 5000))
+BULK_DEFAULT_ROWS = 500
+BULK_SAMPLE = 10
+
+@app.route('/keys/bulk', methods=['POST'])
+def bulk_mutate_keys():
+    data = request.json
+    if data.get('admin_secret') != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    action = data.get('action')
+    if action not in BULK_KEY_ACTIONS and action not in BULK_ACTIONS:
+        return jsonify({"error": f"action must be one of {', '.join(BULK_KEY_ACTIONS + tuple(BULK_ACTIONS))}"}), 400
+    try:
+        where, params = keyfilter.build_where(data.get('filter') or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not where:
+        return jsonify({"error": "A non-empty filter is required"}), 400
+
+    max_rows = data.get('max_rows', BULK_DEFAULT_ROWS)
+    if not isinstance(max_rows, int) or isinstance(max_rows, bool) or max_rows < 1:
+        return jsonify({"error": "max_rows must be a positive integer"}), 400
+    max_rows = min(max_rows, BULK_MAX_ROWS)
+
+    extra = []
+    if action == "set_note":
+        extra = [data.get('note')]
+    elif action == "extend":
+        hours = data.get('hours')
+        if not isinstance(hours, int) or isinstance(hours, bool) or hours < 1:
+            return jsonify({"error": "hours must be a positive integer"}), 400
+        seconds = hours * 3600
+        extra = [hours, seconds, int(time.time()), seconds, seconds]
+        where = f"({where}) AND duration_hours > 0" # So the count matches what extend touches
+
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    try:
+        # One transaction: the count, the cap check and the write all see the same rows
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(f"SELECT key_code FROM licenses WHERE {where} LIMIT ?", params + [max_rows + 1])
+        keys = [row[0] for row in c.fetchall()]
+        if len(keys) > max_rows:
+            conn.rollback()
+            conn.close()
+            return jsonify({"error": f"Filter matches more than {max_rows} keys; narrow it or raise max_rows (up to {BULK_MAX_ROWS})."}), 400
+        if data.get('dry_run') or not keys:
+            conn.rollback()
+            conn.close()
+            return jsonify({"dry_run": bool(data.get('dry_run')), "matched": len(keys), "affected": 0, "sample": keys[:BULK_SAMPLE]})
+
+        if action == "reset":
+            affected = reset_keys(c, keys)
+        elif action == "ban":
+            affected = ban_keys(c, keys, data.get('reason', 'Banned by Admin'))
+        elif action == "recover":
+            affected = recover_keys(c, keys)
+        elif action == "delete":
+            affected = delete_keys(c, keys)
+        else:
+            c.execute(BULK_ACTIONS[action].format(where=where), extra + params)
+            affected = c.rowcount
+        mark_cache_dirty(shmcache.KIND_LICENSE)
+        rescheduled = []
+        if action == "extend":
+            placeholders = ','.join('?' for _ in keys)
+            c.execute(f"SELECT key_code, expires_epoch FROM licenses WHERE status='used' AND expires_epoch IS NOT NULL AND key_code IN ({placeholders})", keys)
+            rescheduled = c.fetchall()
+        conn.commit()
+        bump_cache_dirty()
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 500
+    conn.close()
+
+    for key, expires_epoch in rescheduled:
+        expiry_sweeper.schedule(key, expires_epoch)
+    print(f"[Bulk] {action} on {affected} keys")
+    return jsonify({"dry_run": False, "matched": len(keys), "affected": affected, "sample": keys[:BULK_SAMPLE]})
+
 @app.route('/info', methods=['POST'])
 def key_info():
     data = request.json
@@ -707,7 +1607,9 @@ def key_info():
     conn.close()
     
     if row:
-        return jsonify(dict(row))
+        info = dict(row)
+        info['online'] = presence.tracker.online_for(key)
+        return jsonify(info)
     else:
         return jsonify({"error": "Key not found"}), 404
 
@@ -717,16 +1619,114 @@ def list_keys():
     if data.get('admin_secret') != ADMIN_SECRET:
         return jsonify({"error": "Unauthorized"}), 401
     
+    after, limit, error = parse_page_args(data)
+    if error:
+        return jsonify({"error": error}), 400
+    cached = not_modified(data, telemetry_window())
+    if cached:
+        return cached
+    
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    # Get all keys ordered by creation
-    c.execute("SELECT * FROM licenses ORDER BY created_at DESC")
-    rows = c.fetchall()
+    if data.get('all'):
+        # Get all keys ordered by creation
+        c.execute("SELECT * FROM licenses ORDER BY created_at DESC")
+        rows, next_cursor = c.fetchall(), None
+    else:
+        rows, next_cursor = fetch_key_page(c, "", (), after, limit)
     keys = [dict(row) for row in rows]
     conn.close()
     
-    return jsonify({"keys": keys})
+    return listing_response(data, "keys", keys, next=next_cursor)
+
+@app.route('/keys/search', methods=['POST'])
+def search_keys():
+    # Structured filters run in SQL (keyfilter.py); only matching rows are returned
+    data = request.json
+    if data.get('admin_secret') != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    limit, error = parse_limit(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        # Sorts can be on any column, so pages are by offset: `after` is the previous page's `next`
+        offset = int(data.get('after') or 0)
+        if offset < 0:
+            raise ValueError("Invalid cursor")
+        keyfilter.build_where(data)
+        keyfilter.build_order(data.get('sort'), data.get('order'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cached = not_modified(data, telemetry_window())
+    if cached:
+        return cached
+
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    rows, next_offset = keyfilter.search(c, data, limit, offset)
+    keys = [dict(row) for row in rows]
+    conn.close()
+
+    return listing_response(data, "keys", keys, next=str(next_offset) if next_offset else None)
+
+@app.route('/keys/lookup', methods=['POST'])
+def lookup_keys():
+    # Ranked substring search over key, device name and note (fulltext.py)
+    data = request.json
+    if data.get('admin_secret') != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    query = (data.get('query') or "").strip()
+    if not query:
+        return jsonify({"error": "Missing query"}), 400
+    limit, error = parse_limit(data)
+    if error:
+        return jsonify({"error": error}), 400
+    cached = not_modified(data, telemetry_window())
+    if cached:
+        return cached
+
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    rows, total = fulltext.lookup(c, query, limit)
+    keys = [dict(row) for row in rows]
+    conn.close()
+
+    return listing_response(data, "keys", keys, total=total)
+
+@app.route('/export', methods=['POST'])
+def export_keys():
+    # Full license dump streamed as NDJSON or CSV; never holds the table in memory
+    data = request.json
+    if data.get('admin_secret') != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    fmt = data.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+
+    # Optional filters, same as /keys/search (keyfilter.py)
+    try:
+        where, params = keyfilter.build_where(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sql = "SELECT * FROM licenses"
+    if where:
+        sql += " WHERE " + where
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.execute(sql + " ORDER BY created_at DESC, key_code DESC", params)
+
+    headers = {"Content-Disposition": f"attachment; filename=licenses.{fmt}", "X-Accel-Buffering": "no"}
+    gzip = bool(data.get('gzip'))
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return Response(export.stream(conn, c, fmt, gzip), mimetype=export.FORMATS[fmt], headers=headers)
 
 @app.route('/blacklist/manage', methods=['POST'])
 def manage_blacklist():
@@ -737,6 +1737,11 @@ def manage_blacklist():
     action = data.get('action') # 'add', 'remove', 'list'
     hwid = data.get('hwid')
     reason = data.get('reason', 'No reason provided')
+
+    if action == 'list':
+        cached = not_modified(data, counter='blacklist_version')
+        if cached:
+            return cached
     
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
@@ -747,7 +1752,9 @@ def manage_blacklist():
             return jsonify({"error": "Missing HWID"}), 400
         try:
             c.execute("INSERT INTO blacklist (hwid, reason) VALUES (?, ?)", (hwid, reason))
+            revoke_access(c, hwids=[hwid], reason="blacklisted")
             conn.commit()
+            bump_cache_dirty()
             msg = f"HWID {hwid} added to blacklist."
         except sqlite3.IntegrityError:
             msg = "HWID already blacklisted."
@@ -757,7 +1764,9 @@ def manage_blacklist():
             conn.close()
             return jsonify({"error": "Missing HWID"}), 400
         c.execute("DELETE FROM blacklist WHERE hwid=?", (hwid,))
+        mark_cache_dirty(shmcache.KIND_BLACKLIST)
         conn.commit()
+        bump_cache_dirty()
         msg = f"HWID {hwid} removed from blacklist."
         
     elif action == 'list':
@@ -768,7 +1777,7 @@ def manage_blacklist():
         rows = c.fetchall()
         result = [dict(row) for row in rows]
         conn.close()
-        return jsonify({"blacklist": result})
+        return listing_response(data, "blacklist", result)
         
     else:
         conn.close()
@@ -777,6 +1786,13 @@ def manage_blacklist():
     conn.close()
     return jsonify({"success": True, "message": msg})
 
+@app.route('/metrics', methods=['POST'])
+def get_metrics():
+    data = request.json
+    if data.get('admin_secret') != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(metrics.snapshot())
+
 @app.route('/pcredit/manage', methods=['POST'])
 def manage_pcredit():
     data = request.json
@@ -847,6 +1863,7 @@ def get_pcredit_balance():
 
 if __name__ == '__main__':
     init_db()
+    start_background_workers()
     print("==========================================")
     print("  Pillow Auth Server - ONE KEY LIMIT: ON  ")
     print("==========================================")
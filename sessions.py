@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# OAuth link sessions (desktop client polls /auth/discord/status until the
+# callback has stored its result). Entries expire after LINK_SESSION_TTL,
+# the store is capped at LINK_SESSION_MAX with LRU eviction, and a result is
+# handed out once. With LINK_SESSION_PERSIST=1 entries are also written to
+# SQLite so a restart between callback and status read does not lose them.
+#
+# Instead of polling, the client can long-poll (?wait=N) or hold an SSE stream
+# (?stream=1) on the status route: waiters park on a per-session Event that
+# put() sets. Parked waiters are capped in total and per session; over the
+# cap a long-poll degrades to a plain poll and a stream is refused.
+
+LINK_SESSION_TTL = int(os.environ.get("LINK_SESSION_TTL", 600))
+LINK_SESSION_MAX = int(os.environ.get("LINK_SESSION_MAX", 5000))
+LINK_SESSION_PERSIST = os.environ.get("LINK_SESSION_PERSIST", "0") == "1"
+LINK_WAIT_MAX = int(os.environ.get("LINK_WAIT_MAX", 100))
+LINK_WAIT_PER_SESSION = 2
+# Longest single long-poll, and longest SSE stream (seconds)
+LINK_WAIT_SECONDS = 25
+LINK_STREAM_SECONDS = 300
+HEARTBEAT_INTERVAL = 15
+
+class LinkSessionStore:
+    def __init__(self, ttl=LINK_SESSION_TTL, max_size=LINK_SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.db_file = None
+        self._lock = threading.Lock()
+        # session_id -> (expires_at, data), oldest first
+        self._entries = OrderedDict()
+        # session_id -> [waiter count, Event]
+        self._waiters = {}
+        self._waiting = 0
+
+    def enable_persistence(self, db_file):
+        """Creates the table and loads unexpired sessions (called from init_db)."""
+        self.db_file = db_file
+        conn = sqlite3.connect(db_file)
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS link_sessions
+                     (session_id TEXT PRIMARY KEY, 
+                      data TEXT, 
+                      expires_at REAL)''')
+        c.execute("DELETE FROM link_sessions WHERE expires_at <= ?", (time.time(),))
+        c.execute("SELECT session_id, data, expires_at FROM link_sessions ORDER BY expires_at")
+        rows = c.fetchall()
+        conn.commit()
+        conn.close()
+        with self._lock:
+            for session_id, data, expires_at in rows:
+                self._entries[session_id] = (expires_at, json.loads(data))
+            self._trim()
+
+    def put(self, session_id, data):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[session_id] = (expires_at, data)
+            self._entries.move_to_end(session_id)
+            self._trim()
+            waiter = self._waiters.get(session_id)
+            if waiter:
+                waiter[1].set()
+        if self.db_file:
+            self._db("INSERT OR REPLACE INTO link_sessions (session_id, data, expires_at) VALUES (?, ?, ?)",
+                     (session_id, json.dumps(data), expires_at))
+
+    def consume(self, session_id):
+        """Returns the stored data once, then forgets it. None if missing/expired."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return None
+        if self.db_file:
+            self._db("DELETE FROM link_sessions WHERE session_id=?", (session_id,))
+        expires_at, data = entry
+        if expires_at <= time.time():
+            return None
+        return data
+
+    def size(self):
+        return len(self._entries)
+
+    def waiting(self):
+        return self._waiting
+
+    def subscribe(self, session_id):
+        """Returns an Event set once the session has a result, or None if the waiter caps are hit."""
+        with self._lock:
+            waiter = self._waiters.get(session_id)
+            if self._waiting >= LINK_WAIT_MAX or (waiter and waiter[0] >= LINK_WAIT_PER_SESSION):
+                metrics.inc("link_wait_rejected")
+                return None
+            if waiter is None:
+                waiter = self._waiters[session_id] = [0, threading.Event()]
+                if session_id in self._entries:
+                    waiter[1].set() # Callback already ran
+            waiter[0] += 1
+            self._waiting += 1
+            return waiter[1]
+
+    def unsubscribe(self, session_id):
+        with self._lock:
+            waiter = self._waiters[session_id]
+            waiter[0] -= 1
+            self._waiting -= 1
+            if not waiter[0]:
+                del self._waiters[session_id]
+
+    def consume_wait(self, session_id, timeout):
+        """Long-poll: like consume(), but waits up to `timeout` seconds for the callback."""
+        data = self.consume(session_id)
+        if data is not None or timeout <= 0:
+            return data
+        event = self.subscribe(session_id)
+        if event is None:
+            return None # Over the cap: answer like a plain poll
+        try:
+            event.wait(timeout)
+        finally:
+            self.unsubscribe(session_id)
+        return self.consume(session_id)
+
+    def stream(self, session_id, event, until):
+        """SSE generator for a subscribed waiter; ends with a `done` event or at `until` (unix seconds)."""
+        try:
+            yield "event: hello\ndata: {}\n\n"
+            while True:
+                remaining = until - time.time()
+                if remaining <= 0:
+                    yield 'event: timeout\ndata: {"done": false}\n\n'
+                    return
+                if not event.wait(min(HEARTBEAT_INTERVAL, remaining)):
+                    yield ": ping\n\n"
+                    continue
+                data = self.consume(session_id)
+                # None here: another waiter on the same session took the one-time result
+                body = {"done": True, "data": data} if data is not None else {"done": False}
+                yield f"event: done\ndata: {json.dumps(body)}\n\n"
+                return
+        finally:
+            self.unsubscribe(session_id)
+
+    def _trim(self):
+        # Caller holds the lock. Oldest entries are also the first to expire (fixed TTL).
+        now = time.time()
+        while self._entries:
+            session_id, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+            if len(self._entries) >= self.max_size:
+                metrics.inc("link_sessions_evicted")
+
+    def _db(self, sql, params):
+        try:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute(sql, params)
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"[Sessions] Persistence failed: {e}")
+
+link_sessions = LinkSessionStore()
+metrics.register_gauge("link_sessions_size", link_sessions.size)
+metrics.register_gauge("link_session_waiters", link_sessions.waiting)
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Sliding-window key-sharing detector for HWID mismatches on /verify.
+# Each subject (a key or a discord_id) keeps a ring of BUCKETS buckets
+# covering WINDOW seconds; a bucket holds the mismatch count plus the HWIDs
+# and IPs seen in it, capped so memory per subject is bounded. Subjects live
+# in an LRU capped at MAX_SUBJECTS. Crossing a threshold returns a decision
+# once per window; further attempts in the same window are reported as
+# already handled so callers can stay quiet.
+
+WINDOW = int(os.environ.get("SHARING_WINDOW", 3600))
+BUCKETS = 12
+MAX_SUBJECTS = 10000
+# Flag thresholds (attempts / distinct HWIDs / distinct IPs in the window)
+FLAG_ATTEMPTS = int(os.environ.get("SHARING_FLAG_ATTEMPTS", 5))
+FLAG_HWIDS = int(os.environ.get("SHARING_FLAG_HWIDS", 3))
+FLAG_IPS = int(os.environ.get("SHARING_FLAG_IPS", 3))
+# Ban thresholds, 0 = never auto-ban
+BAN_ATTEMPTS = int(os.environ.get("SHARING_BAN_ATTEMPTS", 0))
+BAN_HWIDS = int(os.environ.get("SHARING_BAN_HWIDS", 0))
+BAN_IPS = int(os.environ.get("SHARING_BAN_IPS", 0))
+# No point remembering more distinct values than the highest threshold needs
+_DISTINCT_CAP = max(FLAG_HWIDS, FLAG_IPS, BAN_HWIDS, BAN_IPS) + 1
+
+class _Subject:
+    __slots__ = ("buckets", "level")
+
+    def __init__(self):
+        # [bucket_id, attempts, hwids, ips] per slot
+        self.buckets = [[-1, 0, set(), set()] for _ in range(BUCKETS)]
+        # (bucket_id, "flag"/"ban") of the last decision, so each level fires once per window
+        self.level = None
+
+class SharingDetector:
+    def __init__(self):
+        self._subjects = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, subject, hwid, ip):
+        """
+        Records one mismatch for `subject`.
+        Returns (decision, stats): decision is "flag"/"ban" when a threshold is newly crossed,
+        "handled" if one was already crossed this window, else None.
+        """
+        bucket_id = int(time.time() // (WINDOW / BUCKETS))
+        with self._lock:
+            state = self._subjects.get(subject)
+            if state is None:
+                state = self._subjects[subject] = _Subject()
+                if len(self._subjects) > MAX_SUBJECTS:
+                    self._subjects.popitem(last=False)
+            else:
+                self._subjects.move_to_end(subject)
+
+            slot = state.buckets[bucket_id % BUCKETS]
+            if slot[0] != bucket_id:
+                slot[0], slot[1] = bucket_id, 0
+                slot[2].clear()
+                slot[3].clear()
+            slot[1] += 1
+            if len(slot[2]) < _DISTINCT_CAP:
+                slot[2].add(hwid)
+            if ip and len(slot[3]) < _DISTINCT_CAP:
+                slot[3].add(ip)
+
+            attempts = 0
+            hwids = set()
+            ips = set()
+            for b in state.buckets:
+                if bucket_id - b[0] < BUCKETS:
+                    attempts += b[1]
+                    hwids |= b[2]
+                    ips |= b[3]
+            stats = {"attempts": attempts, "hwids": len(hwids), "ips": len(ips)}
+
+            decision = None
+            if _crossed(stats, BAN_ATTEMPTS, BAN_HWIDS, BAN_IPS):
+                decision = "ban"
+            elif _crossed(stats, FLAG_ATTEMPTS, FLAG_HWIDS, FLAG_IPS):
+                decision = "flag"
+            if decision is None:
+                return None, stats
+
+            # Already acted at this level (or higher) within the window
+            if state.level and bucket_id - state.level[0] < BUCKETS:
+                if state.level[1] == "ban" or state.level[1] == decision:
+                    return "handled", stats
+            state.level = (bucket_id, decision)
+        metrics.inc(f"sharing_{decision}")
+        return decision, stats
+
+    def size(self):
+        return len(self._subjects)
+
+def _crossed(stats, attempts, hwids, ips):
+    return ((attempts and stats["attempts"] >= attempts) or
+            (hwids and stats["hwids"] >= hwids) or
+            (ips and stats["ips"] >= ips))
+
+detector = SharingDetector()
+metrics.register_gauge("sharing_subjects", detector.size)
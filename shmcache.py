@@ -0,0 +1,185 @@
+import os
+import mmap
+import struct
+import fcntl
+import hashlib
+import threading
+
+# Cross-process cache of the /verify working set (license rows + blacklist hits).
+# One mmap'd file is shared by every worker process, so memory stays the
+# same however many workers run and an invalidation in one is seen by all.
+#
+# Layout: a header with two generation counters (licenses, blacklist),
+# followed by fixed-size slots in an open-addressing table with bounded
+# linear probing. Each slot is stamped with the generation it was filled at
+# and is only trusted while that generation is current, so writers never
+# chase individual entries: they commit, then bump the generation.
+# Readers take no lock; every slot carries a seqlock counter (odd while
+# being written) and a read is retried/abandoned if it changes underneath.
+# Writers serialise with flock (cross-process) plus a thread lock.
+
+MAGIC = b"PILLOWC1"
+HEADER = struct.Struct("<8sQQI")             # magic, license gen, blacklist gen, capacity
+SLOT = struct.Struct("<QQQBB6xqq64s64s32s")  # seq, gen, hash, kind, status, duration, expires_epoch, ident, hwid, discord_id
+MAX_PROBE = 8
+
+KIND_LICENSE = 1
+KIND_BLACKLIST = 2
+
+STATUS_CODES = {"unused": 1, "used": 2, "banned": 3, "expired": 4}
+STATUS_NAMES = {v: k for k, v in STATUS_CODES.items()}
+
+_GEN_OFFSET = {KIND_LICENSE: 8, KIND_BLACKLIST: 16}
+
+def _hash(text):
+    # Must be identical in every process, so no built-in hash()
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+def _fit(text, size):
+    raw = (text or "").encode()
+    return raw if len(raw) <= size else None
+
+class SharedVerifyCache:
+    def __init__(self, path, capacity=16384):
+        self.path = path
+        self._tlock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._fd = fd
+        self._mm = None
+        size = HEADER.size + SLOT.size * capacity
+        try:
+            with self._flock():
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, HEADER.pack(MAGIC, 1, 1, capacity), 0)
+            self._mm = mmap.mmap(fd, size)
+            magic, _, _, cap = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or cap != capacity:
+                raise RuntimeError(f"Incompatible cache file {path}")
+        except Exception:
+            self.close()
+            raise
+        self.capacity = capacity
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    # --- locking -------------------------------------------------------
+
+    def _flock(self):
+        cache = self
+
+        class _Guard:
+            def __enter__(self):
+                cache._tlock.acquire()
+                fcntl.flock(cache._fd, fcntl.LOCK_EX)
+
+            def __exit__(self, *exc):
+                fcntl.flock(cache._fd, fcntl.LOCK_UN)
+                cache._tlock.release()
+        return _Guard()
+
+    # --- generations ---------------------------------------------------
+
+    def generation(self, kind):
+        return struct.unpack_from("<Q", self._mm, _GEN_OFFSET[kind])[0]
+
+    def bump(self, kind):
+        with self._flock():
+            struct.pack_into("<Q", self._mm, _GEN_OFFSET[kind], self.generation(kind) + 1)
+
+    def bump_all(self):
+        self.bump(KIND_LICENSE)
+        self.bump(KIND_BLACKLIST)
+
+    # --- slots ---------------------------------------------------------
+
+    def _offset(self, index):
+        return HEADER.size + SLOT.size * (index % self.capacity)
+
+    def _read(self, kind, ident):
+        h = _hash(ident)
+        raw_ident = _fit(ident, 64)
+        if raw_ident is None:
+            return None
+        gen = self.generation(kind)
+        for i in range(MAX_PROBE):
+            off = self._offset(h + i)
+            slot = SLOT.unpack_from(self._mm, off)
+            seq = slot[0]
+            if seq == 0:
+                return None # Never-written slot ends the probe chain
+            if seq & 1 or slot[2] != h or slot[3] != kind:
+                continue
+            if struct.unpack_from("<Q", self._mm, off)[0] != seq:
+                continue # Torn read, treat as miss
+            if slot[7].rstrip(b"\0") != raw_ident:
+                continue
+            return slot if slot[1] == gen else None
+        return None
+
+    def _write(self, kind, ident, gen, status, duration=0, expires_epoch=0, hwid=None, discord_id=None):
+        raw = (_fit(ident, 64), _fit(hwid, 64), _fit(discord_id, 32))
+        if None in raw:
+            return # Too long to cache; the caller just keeps using the DB
+        h = _hash(ident)
+        with self._flock():
+            current = self.generation(kind)
+            if gen != current:
+                return # A writer committed since we read the DB; our row may be stale
+            target = None
+            for i in range(MAX_PROBE):
+                off = self._offset(h + i)
+                seq, slot_gen, slot_hash, slot_kind = struct.unpack_from("<QQQB", self._mm, off)
+                if seq == 0 or (slot_hash == h and slot_kind == kind):
+                    target = off
+                    break
+                if target is None and slot_gen != self.generation(slot_kind or kind):
+                    target = off # Stale slot, reuse it
+            if target is None:
+                target = self._offset(h) # Table full around here: evict the home slot
+            seq = struct.unpack_from("<Q", self._mm, target)[0]
+            struct.pack_into("<Q", self._mm, target, seq + 1) # odd: write in progress
+            SLOT.pack_into(self._mm, target, seq + 1, gen, h, kind, status, duration or 0, expires_epoch or 0, *raw)
+            struct.pack_into("<Q", self._mm, target, seq + 2)
+
+    # --- public API ----------------------------------------------------
+
+    def get_license(self, key):
+        """Returns (status, hwid, duration_hours, discord_id, expires_epoch) or None on a miss."""
+        slot = self._read(KIND_LICENSE, key)
+        if not slot:
+            return None
+        hwid = slot[8].rstrip(b"\0").decode() or None
+        discord_id = slot[9].rstrip(b"\0").decode() or None
+        return STATUS_NAMES[slot[4]], hwid, slot[5], discord_id, slot[6] or None
+
+    def put_license(self, gen, key, status, hwid, duration, discord_id, expires_epoch):
+        if status not in STATUS_CODES:
+            return
+        self._write(KIND_LICENSE, key, gen, STATUS_CODES[status], duration, expires_epoch, hwid, discord_id)
+
+    def get_blacklisted(self, hwid):
+        """Returns True/False, or None on a miss."""
+        slot = self._read(KIND_BLACKLIST, hwid)
+        return None if slot is None else bool(slot[4])
+
+    def put_blacklisted(self, gen, hwid, blacklisted):
+        self._write(KIND_BLACKLIST, hwid, gen, 1 if blacklisted else 0)
+
+def open_cache(db_file):
+    # One cache file per database, next to it (override with SHM_CACHE_PATH, disable with SHM_CACHE=0)
+    if os.environ.get("SHM_CACHE", "1") == "0":
+        return None
+    path = os.environ.get("SHM_CACHE_PATH") or db_file + "-cache"
+    try:
+        return SharedVerifyCache(path, int(os.environ.get("SHM_CACHE_SLOTS", 16384)))
+    except (OSError, RuntimeError) as e:
+        print(f"[Cache] Shared cache disabled: {e}")
+        return None
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BOT_CONFIG_PATH", os.path.join(tempfile.gettempdir(), "no_bot_config.json"))
+import server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "DB_FILE", str(tmp_path / "keys.db"))
+    server.init_db()
+    yield server.app.test_client()
+    if server.shared_cache:
+        server.shared_cache.close()
+        server.shared_cache = None
+
+
+def generate_key(client):
+    resp = client.post('/generate', json={"admin_secret": server.ADMIN_SECRET, "amount": 1, "discord_id": "42"})
+    return resp.json["keys"][0]
+
+
+def test_concurrent_activation_does_not_take_over_key(client, monkeypatch):
+    # A second device verifying while the first activation is still finishing
+    # its request (webhook, response) must not overwrite the stored HWID
+    key = generate_key(client)
+    second = []
+    send_verify_webhook = server.send_verify_webhook
+
+    def race(event):
+        if not second:
+            second.append(client.post('/verify', json={"key": key, "hwid": "ATTACKER"}))
+        send_verify_webhook(event)
+
+    monkeypatch.setattr(server, "send_verify_webhook", race)
+    first = client.post('/verify', json={"key": key, "hwid": "OWNER"})
+
+    assert first.json["message"] == "Key Activated Successfully!"
+    assert second[0].status_code == 403
+    assert second[0].json["message"] == "Key already used on another device!"
+    conn = sqlite3.connect(server.DB_FILE)
+    assert conn.execute("SELECT hwid FROM licenses WHERE key_code=?", (key,)).fetchone()[0] == "OWNER"
+    conn.close()
+    assert client.post('/verify', json={"key": key, "hwid": "OWNER"}).json["valid"]
+
+
+def test_activation_that_loses_the_race_is_judged_against_the_winner(client):
+    # The key was activated after this request read it as unused
+    key = generate_key(client)
+    conn = sqlite3.connect(server.DB_FILE)
+    c = conn.cursor()
+    server.load_license(c, key)  # fills the shared cache with the unused row
+    c.execute("UPDATE licenses SET status='used', hwid='OWNER' WHERE key_code=?", (key,))
+    conn.commit()
+
+    with server.app.test_request_context():
+        result, code, _ = server._verify_license(c, key, "ATTACKER", "pc", "127.0.0.1")
+        conn.commit()
+    assert code == 403
+    assert c.execute("SELECT hwid FROM licenses WHERE key_code=?", (key,)).fetchone()[0] == "OWNER"
+    conn.close()
@@ -0,0 +1,211 @@
+import json
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+
+import requests
+
+import metrics
+import outbound
+
+# Background Discord webhook delivery.
+# Request threads only put embeds on a bounded in-memory queue and return.
+# The dispatcher thread moves them into a SQLite outbox (so a restart does
+# not lose them), then posts up to 10 embeds per webhook message, honouring
+# Discord's 429 retry_after and backing off on other failures.
+# Every worker process runs a dispatcher on the same outbox, so a batch is
+# claimed (claim token + next_attempt pushed out by CLAIM_SECONDS, in one
+# UPDATE) before it is posted; a claim left by a crashed worker just expires.
+
+MAX_QUEUE = 1000
+EMBEDS_PER_MESSAGE = 10
+# Discord rejects messages whose embeds total more than 6000 characters
+MAX_MESSAGE_CHARS = 5800
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 300
+CLAIM_SECONDS = 120
+# Discord's per-embed limits; anything past them gets the whole message rejected
+MAX_FIELDS = 25
+MAX_FIELD_NAME = 256
+MAX_FIELD_VALUE = 1024
+
+def _clip(text, limit):
+    text = str(text) if text is not None else ""
+    if not text.strip():
+        return "-" # Discord rejects empty names/values
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def clean_fields(fields):
+    """Makes embed fields safe to send: client-supplied values may be empty or huge."""
+    return [dict(f, name=_clip(f.get("name"), MAX_FIELD_NAME), value=_clip(f.get("value"), MAX_FIELD_VALUE))
+            for f in fields[:MAX_FIELDS]]
+
+class WebhookDispatcher:
+    def __init__(self, outbox_file, get_webhook_url):
+        self.outbox_file = outbox_file
+        self.get_webhook_url = get_webhook_url
+        self._queue = queue.Queue(maxsize=MAX_QUEUE)
+        self._pending = 0
+        self._paused_until = 0.0
+        # Outbox rows up to this id are sent one per message (a batch containing them was rejected)
+        self._solo_until = 0
+        self._thread = None
+        metrics.register_gauge("webhook_queue_depth", self._queue.qsize)
+        metrics.register_gauge("webhook_outbox_pending", lambda: self._pending)
+
+    def enqueue(self, embed):
+        """Never blocks: drops (and counts) the embed if the queue is full."""
+        try:
+            self._queue.put_nowait(embed)
+        except queue.Full:
+            metrics.inc("webhook_dropped")
+
+    def start(self):
+        if self._thread:
+            return
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS webhook_outbox
+               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                embed TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt REAL DEFAULT 0,
+                claim TEXT)''')
+        conn.commit()
+        conn.close()
+        self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._thread.start()
+
+    def drain_to_outbox(self):
+        # At exit: whatever is still queued in memory goes to the outbox for the next start
+        if self._queue.empty():
+            return
+        conn = self._connect()
+        self._persist(conn, [])
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.outbox_file, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            try:
+                wait = self._step(conn)
+            except Exception as e:
+                print(f"[Webhook] Dispatcher error: {e}")
+                wait = 5
+            if wait:
+                # Sleep until there is new work or a retry is due
+                try:
+                    embed = self._queue.get(timeout=wait)
+                    self._persist(conn, [embed])
+                except queue.Empty:
+                    pass
+
+    def _persist(self, conn, embeds):
+        # Drain whatever else is queued into the same transaction
+        while len(embeds) < 500:
+            try:
+                embeds.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        conn.executemany("INSERT INTO webhook_outbox (embed) VALUES (?)", [(json.dumps(e),) for e in embeds])
+        conn.commit()
+
+    def _step(self, conn):
+        """Sends one batch if one is due. Returns seconds to wait, or 0 to go again immediately."""
+        if not self._queue.empty():
+            self._persist(conn, [])
+
+        now = time.time()
+        self._pending = conn.execute("SELECT COUNT(*) FROM webhook_outbox").fetchone()[0]
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        url = self.get_webhook_url()
+        if not url:
+            return 60 # Nothing configured; keep the outbox until it is
+
+        claim = secrets.token_hex(8)
+        conn.execute('''UPDATE webhook_outbox SET claim=?, next_attempt=? WHERE id IN
+                        (SELECT id FROM webhook_outbox WHERE next_attempt <= ? ORDER BY id LIMIT ?)''',
+                     (claim, now + CLAIM_SECONDS, now, EMBEDS_PER_MESSAGE))
+        conn.commit()
+        rows = conn.execute("SELECT id, embed, attempts FROM webhook_outbox WHERE claim=? ORDER BY id", (claim,)).fetchall()
+        if not rows:
+            row = conn.execute("SELECT MIN(next_attempt) FROM webhook_outbox").fetchone()
+            return max(0.5, min(60, row[0] - now)) if row[0] else 60
+
+        batch, size = [], 0
+        for row_id, embed_json, attempts in rows:
+            if batch and (size + len(embed_json) > MAX_MESSAGE_CHARS or row_id <= self._solo_until):
+                break
+            if row_id <= self._solo_until:
+                batch.append((row_id, json.loads(embed_json), attempts))
+                break
+            batch.append((row_id, json.loads(embed_json), attempts))
+            size += len(embed_json)
+
+        ids = [b[0] for b in batch]
+        # Claimed rows that did not fit this message are due again right away
+        self._release(conn, [r[0] for r in rows[len(batch):]], now)
+        try:
+            resp = outbound.client.post(url, "webhook", json={"embeds": [b[1] for b in batch]})
+        except requests.RequestException as e:
+            print(f"[Webhook] Post failed: {e}")
+            self._retry_later(conn, batch)
+            return 0
+
+        if resp.status_code == 429:
+            metrics.inc("webhook_rate_limited")
+            try:
+                retry_after = float(resp.json().get("retry_after", 1))
+            except ValueError:
+                retry_after = float(resp.headers.get("Retry-After", 1))
+            self._paused_until = time.time() + retry_after
+            self._release(conn, ids, self._paused_until)
+            return retry_after
+        if 200 <= resp.status_code < 300:
+            self._delete(conn, ids)
+            metrics.inc("webhook_sent", len(ids))
+            return 0
+        if resp.status_code == 400 and len(batch) > 1:
+            # One bad embed fails the whole message: retry these one by one so only it is lost
+            self._solo_until = max(self._solo_until, max(ids))
+            self._release(conn, ids, now)
+            metrics.inc("webhook_batch_split")
+            return 0
+        if 400 <= resp.status_code < 500:
+            # Discord will never accept this batch (bad embed / deleted webhook)
+            print(f"[Webhook] Discord rejected batch ({resp.status_code}): {resp.text[:200]}")
+            self._delete(conn, ids)
+            metrics.inc("webhook_dropped", len(ids))
+            return 0
+        self._retry_later(conn, batch)
+        return 0
+
+    def _delete(self, conn, ids):
+        conn.execute(f"DELETE FROM webhook_outbox WHERE id IN ({','.join('?' for _ in ids)})", ids)
+        conn.commit()
+
+    def _release(self, conn, ids, next_attempt):
+        if not ids:
+            return
+        conn.execute(f"UPDATE webhook_outbox SET claim=NULL, next_attempt=? WHERE id IN ({','.join('?' for _ in ids)})",
+                     [next_attempt] + ids)
+        conn.commit()
+
+    def _retry_later(self, conn, batch):
+        now = time.time()
+        for row_id, _, attempts in batch:
+            if attempts + 1 >= MAX_ATTEMPTS:
+                conn.execute("DELETE FROM webhook_outbox WHERE id=?", (row_id,))
+                metrics.inc("webhook_dropped")
+            else:
+                conn.execute("UPDATE webhook_outbox SET attempts=?, next_attempt=?, claim=NULL WHERE id=?",
+                             (attempts + 1, now + min(MAX_BACKOFF, 2 ** (attempts + 1)), row_id))
+        conn.commit()